@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+
+
+def revoked_token_key(key):
+    return f'token_revoked:{key}'
+
+
+def revoke_tokens(*keys):
+    cache.set_many(
+        {revoked_token_key(key): uuid4().hex for key in keys},
+        timeout=settings.TOKEN_CACHE_TTL,
+    )
+
+
+def snapshot(instance):
+    return tuple(
+        getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+    )
+
+
+class TokenCache:
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > monotonic() and (
+            cache.get(revoked_token_key(key)) == entry[1]
+        ):
+            with self._lock:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        else:
+            with self._lock:
+                self._entries.pop(key, None)
+                self.misses += 1
+            return None
+        _, _, user_values, token_values = entry
+        user = User.from_db(DEFAULT_DB_ALIAS, None, user_values)
+        token = Token.from_db(DEFAULT_DB_ALIAS, None, token_values)
+        token.user = user
+        return user, token
+
+    def set(self, user, token, expires_at, marker):
+        entry = (expires_at, marker, snapshot(user), snapshot(token))
+        with self._lock:
+            self._entries[token.key] = entry
+            self._entries.move_to_end(token.key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else None,
+            }
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        expires_at = monotonic() + token_cache.ttl
+        marker = cache.get(revoked_token_key(key))
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(user, token, expires_at, marker)
+        return user, token
@@ -0,0 +1,25 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+
+VERSION_KEY = 'version:{}'
+
+
+def get_versions(*names):
+    keys = {name: VERSION_KEY.format(name) for name in names}
+    stored = cache.get_many(keys.values())
+    versions, missing = {}, {}
+    for name, key in keys.items():
+        if key not in stored:
+            stored[key] = missing[key] = uuid4().hex
+        versions[name] = stored[key]
+    if missing:
+        cache.set_many(missing, timeout=None)
+    return versions
+
+
+def bump_versions(*names):
+    cache.set_many(
+        {VERSION_KEY.format(name): uuid4().hex for name in names},
+        timeout=None,
+    )
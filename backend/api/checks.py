@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    hint = 'Укажите REDIS_URL или используйте DatabaseCache.'
+    if settings.DATABASE_REPLICAS:
+        return [Error(
+            'Реплики базы данных требуют общего кэша: иначе после записи '
+            'чтение в другом процессе уйдёт на отстающую реплику.',
+            hint=hint,
+            id='api.E001',
+        )]
+    return [Warning(
+        'Кэш по умолчанию не общий для процессов: версии кэшей, '
+        'отзыв токенов и привязка чтения к основной базе не дойдут '
+        'до других процессов.',
+        hint=hint,
+        id='api.W001',
+    )]
@@ -0,0 +1,66 @@
+from io import BytesIO
+from uuid import uuid4
+
+from django.core.files.storage import default_storage
+from drf_extra_fields.fields import Base64FileField
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import Field, FileField
+
+from recipes.images import identify_image, sniff_image_type
+
+
+class Base64ImageField(Base64FileField):
+    ALLOWED_TYPES = ('jpg', 'png', 'gif', 'webp')
+    INVALID_FILE_MESSAGE = 'Загрузите корректное изображение.'
+    INVALID_TYPE_MESSAGE = 'Не удалось определить формат изображения.'
+
+    def validate_image(self, file):
+        extension = sniff_image_type(file.read(16))
+        file.seek(0)
+        if extension is not None and identify_image(file) != extension:
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        file.seek(0)
+        return extension
+
+    def get_file_extension(self, filename, decoded_file):
+        return self.validate_image(BytesIO(decoded_file))
+
+    def to_internal_value(self, data):
+        if not hasattr(data, 'read'):
+            return super().to_internal_value(data)
+        extension = self.validate_image(data)
+        if extension not in self.ALLOWED_TYPES:
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        data.name = f'{uuid4()}.{extension}'
+        return FileField.to_internal_value(self, data)
+
+
+def absolute_variant_urls(variants, request):
+    return {
+        variant: {
+            image_format: request.build_absolute_uri(url)
+            for image_format, url in formats.items()
+        }
+        for variant, formats in variants.items()
+    }
+
+
+class ImageVariantsField(Field):
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        urls = {
+            variant: {
+                image_format: default_storage.url(name)
+                for image_format, name in formats.items()
+            }
+            for variant, formats in variants.items()
+            if variant != 'source'
+        }
+        request = self.context.get('request')
+        if request is None:
+            return urls
+        return absolute_variant_urls(urls, request)
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+
+from foodgram.routers import use_primary
+from recipes.models import Ingredient, Tag
+from .cache import get_versions
+
+
+def recipe_version_key(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def user_version_key(user_id):
+    return f'user:{user_id}'
+
+
+class RecipeFragmentCache:
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get_many(self, recipes, build):
+        catalog = (Tag._meta.db_table, Ingredient._meta.db_table)
+        versions = get_versions(*catalog, *{
+            key for recipe in recipes for key in (
+                recipe_version_key(recipe.id),
+                user_version_key(recipe.author_id),
+            )
+        })
+        expected = {
+            recipe.id: (
+                versions[recipe_version_key(recipe.id)],
+                versions[user_version_key(recipe.author_id)],
+                *(versions[table] for table in catalog),
+            )
+            for recipe in recipes
+        }
+        fragments = {}
+        with self._lock:
+            for recipe_id, version in expected.items():
+                entry = self._entries.get(recipe_id)
+                if entry is not None and entry[0] == version:
+                    self._entries.move_to_end(recipe_id)
+                    fragments[recipe_id] = entry[1]
+            self.hits += len(fragments)
+            self.misses += len(expected) - len(fragments)
+
+        missing = [
+            recipe_id for recipe_id in expected if recipe_id not in fragments
+        ]
+        if missing:
+            with use_primary():
+                built = build(missing)
+            fragments.update(built)
+            with self._lock:
+                for recipe_id, fragment in built.items():
+                    self._entries[recipe_id] = (expected[recipe_id], fragment)
+                    self._entries.move_to_end(recipe_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return fragments
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+recipe_fragments = RecipeFragmentCache(settings.RECIPE_FRAGMENT_CACHE_SIZE)
@@ -0,0 +1,50 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Substr
+
+from api.search import ingredient_index
+from api.serializers import IngredientSerializer
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск ингредиентов по индексу и через icontains'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        queries = sorted(set(
+            Ingredient.objects.annotate(
+                prefix=Substr('name', 1, 3)
+            ).values_list('prefix', flat=True)
+        ))
+        if not queries:
+            self.stderr.write('Таблица ингредиентов пуста.')
+            return
+        ingredient_index.refresh()
+        rounds, limit = options['rounds'], options['limit']
+
+        started = perf_counter()
+        for _ in range(rounds):
+            for query in queries:
+                queryset = Ingredient.objects.filter(name__icontains=query)
+                if limit is not None:
+                    queryset = queryset[:limit]
+                IngredientSerializer(queryset, many=True).data
+        database = perf_counter() - started
+
+        started = perf_counter()
+        for _ in range(rounds):
+            for query in queries:
+                ingredient_index.search(query, limit)
+        index = perf_counter() - started
+
+        total = rounds * len(queries)
+        self.stdout.write(
+            f'Запросов: {total}\n'
+            f'icontains: {database / total * 1000:.3f} мс на запрос\n'
+            f'индекс: {index / total * 1000:.3f} мс на запрос'
+        )
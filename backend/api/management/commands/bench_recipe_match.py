@@ -0,0 +1,74 @@
+import random
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from api.matching import RecipeMatchIndex
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает подбор рецептов по индексу и полным перебором'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--per-recipe', type=int, default=10)
+        parser.add_argument('--have', type=int, default=15)
+        parser.add_argument('--exclude', type=int, default=2)
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        ingredients = range(1, options['ingredients'] + 1)
+        weights = [1 / rank for rank in ingredients]
+        recipes = {
+            recipe_id: set(rng.choices(
+                ingredients, weights, k=rng.randint(1, options['per_recipe'])
+            ))
+            for recipe_id in range(1, options['recipes'] + 1)
+        }
+        queries = [
+            (
+                set(rng.choices(ingredients, weights, k=options['have'])),
+                set(rng.choices(ingredients, weights, k=options['exclude'])),
+            )
+            for _ in range(options['rounds'])
+        ]
+        limit = options['limit']
+
+        index = RecipeMatchIndex()
+        started = perf_counter()
+        index.load(recipes)
+        build = perf_counter() - started
+
+        started = perf_counter()
+        indexed = [
+            index.rank(have, exclude, limit) for have, exclude in queries
+        ]
+        indexed_time = (perf_counter() - started) / len(queries)
+
+        started = perf_counter()
+        scanned = []
+        for have, exclude in queries:
+            scored = sorted(
+                (len(needed - have), recipe_id)
+                for recipe_id, needed in recipes.items()
+                if needed & have and not needed & exclude
+            )[:limit]
+            scanned.append([
+                (recipe_id, missing) for missing, recipe_id in scored
+            ])
+        scanned_time = (perf_counter() - started) / len(queries)
+
+        self.stdout.write(
+            f'Рецептов: {len(recipes)}, '
+            f'построение индекса: {build * 1000:.0f} мс'
+        )
+        self.stdout.write(
+            f'Индекс: {indexed_time * 1000:.2f} мс на запрос, '
+            f'перебор: {scanned_time * 1000:.2f} мс на запрос'
+        )
+        if indexed != scanned:
+            self.stderr.write('Результаты различаются!')
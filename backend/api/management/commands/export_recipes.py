@@ -0,0 +1,30 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from api.transfer import export_recipes
+
+
+class Command(BaseCommand):
+    help = 'Выгружает рецепты в формате NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default='-',
+            help='Файл для выгрузки, по умолчанию стандартный вывод.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        lines = export_recipes(options['batch_size'])
+        if options['output'] == '-':
+            sys.stdout.writelines(lines)
+            return
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            for line in lines:
+                file.write(line)
+                count += 1
+        self.stdout.write(
+            self.style.SUCCESS(f'Выгружено рецептов: {count}')
+        )
@@ -0,0 +1,48 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.transfer import import_recipes
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Загружает рецепты из файла NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='Файл для загрузки, по умолчанию стандартный ввод.',
+        )
+        parser.add_argument(
+            '--author',
+            help='Автор для строк без поля author.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        author = None
+        if options['author']:
+            author = User.objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(
+                    f'Пользователь {options["author"]} не найден.'
+                )
+        if options['path'] == '-':
+            report = import_recipes(
+                sys.stdin.buffer, author, options['batch_size']
+            )
+        else:
+            with open(options['path'], 'rb') as file:
+                report = import_recipes(file, author, options['batch_size'])
+
+        for error in report['errors']:
+            self.stderr.write('Строка {}: {}'.format(
+                error['line'],
+                json.dumps(error['errors'], ensure_ascii=False),
+            ))
+        self.stdout.write(
+            f'Создано рецептов: {report["created"]}, '
+            f'строк с ошибками: {len(report["errors"])}'
+        )
@@ -0,0 +1,189 @@
+from collections import defaultdict
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+
+from foodgram.routers import use_primary
+from recipes.models import Recipe, RecipeIngredient
+from .cache import get_versions
+
+
+def to_bitset(positions):
+    if not positions:
+        return 0
+    bits = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def iter_positions(bitset):
+    bits = bin(bitset)[:1:-1]
+    position = bits.find('1')
+    while position != -1:
+        yield position
+        position = bits.find('1', position + 1)
+
+
+def add_to_counter(planes, bitset):
+    carry = bitset
+    for index, plane in enumerate(planes):
+        if not carry:
+            return
+        planes[index], carry = plane ^ carry, plane & carry
+    if carry:
+        planes.append(carry)
+
+
+def subtract_planes(minuend, subtrahend):
+    width = max(len(minuend), len(subtrahend))
+    minuend = minuend + [0] * (width - len(minuend))
+    subtrahend = subtrahend + [0] * (width - len(subtrahend))
+    difference, borrow = [], 0
+    for left, right in zip(minuend, subtrahend):
+        difference.append(left ^ right ^ borrow)
+        borrow = (~left & right) | (~(left ^ right) & borrow)
+    return difference
+
+
+def equal_to(planes, value, mask):
+    for index, plane in enumerate(planes):
+        mask &= plane if value >> index & 1 else ~plane
+        if not mask:
+            break
+    return mask
+
+
+class RecipeMatchIndex:
+
+    def __init__(self):
+        self._lock = Lock()
+        self._build_lock = Lock()
+        self._version = None
+        self._built_at = 0
+        self.load({})
+
+    def load(self, recipes):
+        recipe_ids = sorted(recipes)
+        postings = defaultdict(list)
+        size_positions = defaultdict(list)
+        for position, recipe_id in enumerate(recipe_ids):
+            ingredient_ids = frozenset(recipes[recipe_id])
+            for ingredient_id in ingredient_ids:
+                postings[ingredient_id].append(position)
+            for bit in range(len(ingredient_ids).bit_length()):
+                if len(ingredient_ids) >> bit & 1:
+                    size_positions[bit].append(position)
+        with self._lock:
+            self._recipe_ids = recipe_ids
+            self._positions = {
+                recipe_id: position
+                for position, recipe_id in enumerate(recipe_ids)
+            }
+            self._ingredients = [
+                frozenset(recipes[recipe_id]) for recipe_id in recipe_ids
+            ]
+            self._postings = {
+                ingredient_id: to_bitset(positions)
+                for ingredient_id, positions in postings.items()
+            }
+            self._size_planes = [
+                to_bitset(size_positions[bit])
+                for bit in range(max(size_positions, default=-1) + 1)
+            ]
+
+    def current_version(self):
+        tables = (Recipe._meta.db_table, RecipeIngredient._meta.db_table)
+        versions = get_versions(*tables)
+        return tuple(versions[table] for table in tables)
+
+    def is_fresh(self, version):
+        return version == self._version and (
+            monotonic() - self._built_at < settings.RECIPE_MATCH_INDEX_TTL
+        )
+
+    def refresh(self):
+        if self.is_fresh(self.current_version()):
+            return
+        with self._build_lock:
+            version = self.current_version()
+            if self.is_fresh(version):
+                return
+            recipes = defaultdict(list)
+            with use_primary():
+                for recipe_id, ingredient_id in (
+                    RecipeIngredient.objects.order_by().values_list(
+                        'recipe_id', 'ingredient_id'
+                    ).iterator()
+                ):
+                    recipes[recipe_id].append(ingredient_id)
+            self.load(recipes)
+            self._version = version
+            self._built_at = monotonic()
+
+    def update_recipes(self, recipe_ids):
+        current = defaultdict(set)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            current[recipe_id].add(ingredient_id)
+        with self._lock:
+            for recipe_id in recipe_ids:
+                self._set_recipe(recipe_id, frozenset(current[recipe_id]))
+
+    def _set_recipe(self, recipe_id, ingredient_ids):
+        position = self._positions.get(recipe_id)
+        if position is None:
+            if not ingredient_ids:
+                return
+            position = len(self._recipe_ids)
+            self._recipe_ids.append(recipe_id)
+            self._positions[recipe_id] = position
+            self._ingredients.append(frozenset())
+        bit = 1 << position
+        previous = self._ingredients[position]
+        for ingredient_id in previous - ingredient_ids:
+            self._postings[ingredient_id] &= ~bit
+        for ingredient_id in ingredient_ids - previous:
+            self._postings[ingredient_id] = (
+                self._postings.get(ingredient_id, 0) | bit
+            )
+        size = len(ingredient_ids)
+        planes = self._size_planes
+        planes.extend([0] * (size.bit_length() - len(planes)))
+        for index, plane in enumerate(planes):
+            planes[index] = plane | bit if size >> index & 1 else plane & ~bit
+        self._ingredients[position] = ingredient_ids
+
+    def match(self, ingredient_ids, exclude_ids=(), limit=None):
+        self.refresh()
+        return self.rank(ingredient_ids, exclude_ids, limit)
+
+    def rank(self, ingredient_ids, exclude_ids=(), limit=None):
+        with self._lock:
+            counters, candidates = [], 0
+            for ingredient_id in set(ingredient_ids):
+                posting = self._postings.get(ingredient_id, 0)
+                add_to_counter(counters, posting)
+                candidates |= posting
+            for ingredient_id in set(exclude_ids):
+                candidates &= ~self._postings.get(ingredient_id, 0)
+            missing = subtract_planes(self._size_planes, counters)
+
+            results = []
+            for count in range(1 << len(missing)):
+                if not candidates or limit is not None and (
+                    len(results) >= limit
+                ):
+                    break
+                matched = equal_to(missing, count, candidates)
+                candidates &= ~matched
+                for position in iter_positions(matched):
+                    results.append((self._recipe_ids[position], count))
+                    if limit is not None and len(results) >= limit:
+                        break
+        return results
+
+
+recipe_match_index = RecipeMatchIndex()
@@ -0,0 +1,40 @@
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+
+class MultiPartJSONParser(MultiPartParser):
+    json_part = 'data'
+    list_fields = ('tags', 'ingredients')
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parsed = super().parse(stream, media_type, parser_context)
+        if self.json_part in parsed.data:
+            try:
+                data = json.loads(parsed.data[self.json_part])
+            except ValueError:
+                raise ParseError(
+                    f'Поле {self.json_part} должно содержать JSON-объект.'
+                )
+            if not isinstance(data, dict):
+                raise ParseError(
+                    f'Поле {self.json_part} должно содержать JSON-объект.'
+                )
+        else:
+            data = self.decode_form(parsed.data)
+        return DataAndFiles(data, parsed.files.dict())
+
+    def decode_form(self, form):
+        data = {}
+        for key, values in form.lists():
+            if key not in self.list_fields:
+                data[key] = values[-1]
+            elif len(values) == 1 and values[0].lstrip().startswith('['):
+                try:
+                    data[key] = json.loads(values[0])
+                except ValueError:
+                    raise ParseError(f'Поле {key} содержит некорректный JSON.')
+            else:
+                data[key] = values
+        return data
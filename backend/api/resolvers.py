@@ -0,0 +1,36 @@
+from users.models import Follow
+
+
+class SubscriptionResolver:
+
+    def __init__(self, user):
+        self.user = user
+        self._pending = set()
+        self._resolved = {}
+
+    @classmethod
+    def for_request(cls, request):
+        resolver = getattr(request, '_subscription_resolver', None)
+        if resolver is None:
+            resolver = cls(request.user)
+            request._subscription_resolver = resolver
+        return resolver
+
+    def register(self, author_ids):
+        self._pending.update(
+            author_id for author_id in author_ids
+            if author_id not in self._resolved
+        )
+
+    def is_subscribed(self, author_id):
+        if self.user.is_anonymous:
+            return False
+        if author_id not in self._resolved:
+            self._pending.add(author_id)
+            subscribed = set(Follow.objects.filter(
+                user=self.user, author_id__in=self._pending
+            ).values_list('author_id', flat=True))
+            for pending_id in self._pending:
+                self._resolved[pending_id] = pending_id in subscribed
+            self._pending.clear()
+        return self._resolved[author_id]
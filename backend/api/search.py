@@ -0,0 +1,58 @@
+from bisect import bisect_left
+from itertools import islice
+from threading import Lock
+
+from foodgram.routers import use_primary
+from recipes.models import Ingredient
+from .cache import get_versions
+
+
+class IngredientIndex:
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._entries = ([], [])
+
+    def refresh(self):
+        table = Ingredient._meta.db_table
+        version = get_versions(table)[table]
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            with use_primary():
+                rows = sorted(
+                    (row['name'].casefold(), row['id'], row)
+                    for row in Ingredient.objects.values(
+                        'id', 'name', 'measurement_unit'
+                    )
+                )
+            self._entries = (
+                [key for key, _, _ in rows],
+                [row for _, _, row in rows],
+            )
+            self._version = version
+
+    def search(self, query, limit=None):
+        self.refresh()
+        keys, rows = self._entries
+        needle = query.strip().casefold()
+        start = bisect_left(keys, needle)
+        end = start
+        while end < len(keys) and keys[end].startswith(needle):
+            end += 1
+        matches = rows[start:end]
+        if limit is not None and len(matches) >= limit:
+            return matches[:limit]
+        substring_matches = (
+            row for key, row in zip(keys, rows)
+            if needle in key and not key.startswith(needle)
+        )
+        if limit is not None:
+            substring_matches = islice(substring_matches, limit - len(matches))
+        return matches + list(substring_matches)
+
+
+ingredient_index = IngredientIndex()
@@ -1,15 +1,37 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
 from django.db import transaction
+from django.db.models import Manager
 from djoser import serializers
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework.exceptions import ValidationError
-from rest_framework.serializers import (BooleanField, CurrentUserDefault,
-                                        IntegerField, ModelSerializer,
+from rest_framework.serializers import (BooleanField, CharField,
+                                        CurrentUserDefault, ImageField,
+                                        IntegerField, ListField,
+                                        ListSerializer, ModelSerializer,
                                         PrimaryKeyRelatedField, ReadOnlyField,
-                                        SerializerMethodField)
+                                        Serializer, SerializerMethodField,
+                                        SlugField)
 
-from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            ShoppingListItem, Tag)
 from users.models import Follow, User
+from .fields import (Base64ImageField, ImageVariantsField,
+                     absolute_variant_urls)
+from .fragments import recipe_fragments
+from .resolvers import SubscriptionResolver
+
+
+class UserListSerializer(ListSerializer):
+    author_id_attribute = 'id'
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, Manager) else data)
+        request = self.context.get('request')
+        if request is not None:
+            SubscriptionResolver.for_request(request).register(
+                getattr(item, self.author_id_attribute) for item in items
+            )
+        return super().to_representation(items)
 
 
 class UserSerializer(serializers.UserSerializer):
@@ -17,6 +39,7 @@ class UserSerializer(serializers.UserSerializer):
 
     class Meta:
         model = User
+        list_serializer_class = UserListSerializer
         fields = (
             'email',
             'id',
@@ -28,9 +51,7 @@ class UserSerializer(serializers.UserSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        if self.context.get('request').user.is_anonymous:
-            return False
-        return obj.following.filter(user=request.user).exists()
+        return SubscriptionResolver.for_request(request).is_subscribed(obj.id)
 
 
 class UserCreateSerializer(serializers.UserCreateSerializer):
@@ -48,6 +69,7 @@ class UserCreateSerializer(serializers.UserCreateSerializer):
 
 class ShortRecipeSerializer(ModelSerializer):
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -55,14 +77,16 @@ class ShortRecipeSerializer(ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time'
         )
 
 
 class SubscribeListSerializer(UserSerializer):
-    recipes = SerializerMethodField()
-    recipes_count = IntegerField(source='recipes.count',
-                                        read_only=True)
+    recipes = ShortRecipeSerializer(
+        source='limited_recipes', many=True, read_only=True
+    )
+    recipes_count = IntegerField(read_only=True)
 
     class Meta(UserSerializer.Meta):
         fields = UserSerializer.Meta.fields + (
@@ -70,15 +94,6 @@ class SubscribeListSerializer(UserSerializer):
         )
         read_only_fields = ('email', 'username', 'first_name', 'last_name', )
 
-    def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
-        serializer = ShortRecipeSerializer(recipes, many=True, read_only=True)
-        return serializer.data
-
 
 class FollowSerializer(UserSerializer):
     user = PrimaryKeyRelatedField(
@@ -125,33 +140,103 @@ class RecipeIngredientSerializer(ModelSerializer):
         )
 
 
-class RecipeSerializer(ModelSerializer):
-    image = Base64ImageField()
+class RecipeAuthorSerializer(ModelSerializer):
+
+    class Meta:
+        model = User
+        fields = UserSerializer.Meta.fields[:-1]
+
+
+class RecipeFragmentSerializer(ModelSerializer):
+    image = ImageField(read_only=True)
+    image_variants = ImageVariantsField()
     tags = TagSerializer(read_only=True, many=True)
-    author = UserSerializer(read_only=True)
+    author = RecipeAuthorSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(
         many=True,
+        read_only=True,
         source='ingredient_list',
     )
-    is_favorited = BooleanField(read_only=True)
-    is_in_shopping_cart = BooleanField(
-        read_only=True
-    )
 
     class Meta:
         model = Recipe
         fields = (
             'id',
             'image',
+            'image_variants',
             'tags',
             'author',
             'ingredients',
             'name',
             'text',
             'cooking_time',
+        )
+
+
+def build_recipe_fragments(recipe_ids):
+    recipes = Recipe.objects.filter(id__in=recipe_ids).with_related()
+    return {
+        fragment['id']: fragment
+        for fragment in RecipeFragmentSerializer(recipes, many=True).data
+    }
+
+
+class RecipeListSerializer(UserListSerializer):
+    author_id_attribute = 'author_id'
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        fragments = recipe_fragments.get_many(
+            recipes, build_recipe_fragments
+        )
+        self.child.fragments = fragments
+        return super().to_representation([
+            recipe for recipe in recipes if recipe.id in fragments
+        ])
+
+
+class RecipeSerializer(RecipeFragmentSerializer):
+    image = Base64ImageField()
+    author = UserSerializer(read_only=True)
+    is_favorited = BooleanField(read_only=True)
+    is_in_shopping_cart = BooleanField(
+        read_only=True
+    )
+    fragments = None
+
+    class Meta:
+        model = Recipe
+        fields = RecipeFragmentSerializer.Meta.fields + (
             'is_favorited',
             'is_in_shopping_cart',
         )
+        list_serializer_class = RecipeListSerializer
+
+    def to_representation(self, instance):
+        fragments = self.fragments
+        if fragments is None:
+            fragments = recipe_fragments.get_many(
+                [instance], build_recipe_fragments
+            )
+        data = dict(fragments[instance.id])
+        request = self.context.get('request')
+        if request is not None:
+            if data['image']:
+                data['image'] = request.build_absolute_uri(data['image'])
+            data['image_variants'] = absolute_variant_urls(
+                data['image_variants'], request
+            )
+        data['author'] = dict(
+            data['author'],
+            is_subscribed=SubscriptionResolver.for_request(
+                request
+            ).is_subscribed(instance.author_id),
+        )
+        data['is_favorited'] = getattr(instance, 'is_favorited', False)
+        data['is_in_shopping_cart'] = getattr(
+            instance, 'is_in_shopping_cart', False
+        )
+        return data
 
 
 class RecipeCreateSerializer(ModelSerializer):
@@ -222,16 +307,64 @@ class RecipeCreateSerializer(ModelSerializer):
         self.create_ingredients(recipe, ingredients_data)
         return recipe
 
-    @transaction.atomic
-    def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.set(tags)
+    @staticmethod
+    def update_tags(instance, tags):
+        current = set(instance.tags.values_list('id', flat=True))
+        submitted = {tag.id for tag in tags}
+        if current - submitted:
+            instance.tags.remove(*(current - submitted))
+        if submitted - current:
+            instance.tags.add(*(submitted - current))
 
-        instance.ingredients.clear()
-        ingredients = validated_data.pop('ingredients')
-        self.create_ingredients(instance, ingredients)
+    @staticmethod
+    def update_ingredients(instance, ingredients_data):
+        current = {
+            row.ingredient_id: row for row in instance.ingredient_list.all()
+        }
+        old_amounts = {
+            ingredient_id: row.amount for ingredient_id, row in current.items()
+        }
+        new_amounts = {
+            ingredient['ingredient']['id'].id: ingredient['amount']
+            for ingredient in ingredients_data
+        }
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            instance.ingredient_list.filter(
+                ingredient_id__in=removed
+            ).delete()
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe=instance, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in current
+        ])
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = new_amounts.get(ingredient_id, row.amount)
+            if amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        ShoppingListItem.objects.change_recipe(
+            instance.id,
+            {
+                ingredient_id: amount
+                for ingredient_id, amount in old_amounts.items()
+                if ingredient_id not in removed
+            },
+            new_amounts,
+        )
 
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        tags = validated_data.pop('tags', None)
+        if tags is not None:
+            self.update_tags(instance, tags)
+        ingredients = validated_data.pop('ingredients', None)
+        if ingredients is not None:
+            self.update_ingredients(instance, ingredients)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
@@ -240,13 +373,66 @@ class RecipeCreateSerializer(ModelSerializer):
         }).data
 
 
-class FavoriteSerializer(ModelSerializer):
-    class Meta:
-        model = Favorites
-        fields = ('user', 'recipe')
+class RecipeImportIngredientSerializer(Serializer):
+    name = CharField(max_length=settings.MAX_LEN_RECIPE_FIELD)
+    measurement_unit = CharField(max_length=settings.MAX_LEN_RECIPE_FIELD)
+    amount = IntegerField(
+        min_value=settings.MIN_INGREDIENT_AMOUNT,
+        max_value=settings.MAX_INGREDIENT_AMOUNT,
+    )
 
 
-class ShoppingListSerializer(ModelSerializer):
+class RecipeImportSerializer(ModelSerializer):
+    author = CharField(required=False)
+    image = CharField()
+    tags = ListField(child=SlugField(), allow_empty=False)
+    ingredients = RecipeImportIngredientSerializer(
+        many=True, allow_empty=False
+    )
+
     class Meta:
-        model = ShoppingCart
-        fields = ('user', 'recipe')
+        model = Recipe
+        fields = (
+            'name',
+            'text',
+            'cooking_time',
+            'author',
+            'image',
+            'tags',
+            'ingredients',
+        )
+
+    def validate_image(self, value):
+        if ';base64,' in value:
+            return Base64ImageField().to_internal_value(value)
+        if not default_storage.exists(value):
+            raise ValidationError('Файл изображения не найден.')
+        return value
+
+    def validate_ingredients(self, ingredients):
+        keys = [
+            (ingredient['name'], ingredient['measurement_unit'])
+            for ingredient in ingredients
+        ]
+        if len(set(keys)) != len(keys):
+            raise ValidationError('Нужны уникальные ингредиенты!')
+        return ingredients
+
+
+class RecipeIdsSerializer(Serializer):
+    recipes = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPE_BATCH_MAX_SIZE,
+    )
+
+    def validate_recipes(self, recipe_ids):
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        missing = set(recipe_ids) - set(Recipe.objects.filter(
+            id__in=recipe_ids
+        ).values_list('id', flat=True))
+        if missing:
+            raise ValidationError('Рецепты не найдены: {}'.format(
+                ', '.join(map(str, sorted(missing)))
+            ))
+        return recipe_ids
@@ -0,0 +1,238 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Favorites, FeedEntry, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag)
+from users.models import Follow, User
+from recipes.images import schedule_image_variants
+from .authentication import revoke_tokens
+from .cache import bump_versions
+from .fragments import recipe_version_key, user_version_key
+from .matching import recipe_match_index
+
+COUNTED_MODELS = (
+    Favorites, Follow, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    Tag, User,
+)
+
+
+def bump_on_commit(*names):
+    transaction.on_commit(lambda: bump_versions(*names))
+
+
+def bump_table_version(sender, **kwargs):
+    bump_on_commit(sender._meta.db_table)
+
+
+for model in COUNTED_MODELS:
+    post_save.connect(bump_table_version, sender=model)
+    post_delete.connect(bump_table_version, sender=model)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def bump_recipe_version(sender, instance, **kwargs):
+    bump_on_commit(recipe_version_key(instance.pk))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def update_recipe_match_index(sender, instance, update_fields=None,
+                              **kwargs):
+    if update_fields is None or set(update_fields) - set(
+        Recipe.DERIVED_FIELDS
+    ):
+        recipe_id = instance.pk
+        transaction.on_commit(
+            lambda: recipe_match_index.update_recipes([recipe_id])
+        )
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def update_recipe_ingredient_match_index(sender, instance, **kwargs):
+    recipe_id = instance.recipe_id
+    transaction.on_commit(
+        lambda: recipe_match_index.update_recipes([recipe_id])
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def build_recipe_image_variants(sender, instance, **kwargs):
+    if instance.image and (
+        instance.image_variants.get('source') != instance.image.name
+    ):
+        transaction.on_commit(lambda: schedule_image_variants(instance))
+
+
+@receiver(pre_save, sender=Favorites)
+@receiver(pre_save, sender=RecipeIngredient)
+@receiver(pre_save, sender=ShoppingCart)
+def remember_stored_row(sender, instance, **kwargs):
+    instance.stored_row = None if instance._state.adding else (
+        sender.objects.filter(pk=instance.pk).first()
+    )
+
+
+@receiver(post_save, sender=Favorites)
+@receiver(post_save, sender=ShoppingCart)
+def increment_recipe_counter(sender, instance, created, **kwargs):
+    stored = instance.stored_row
+    if created:
+        sender.objects.update_counters([instance.recipe_id], 1)
+    elif stored is not None and stored.recipe_id != instance.recipe_id:
+        sender.objects.update_counters([stored.recipe_id], -1)
+        sender.objects.update_counters([instance.recipe_id], 1)
+
+
+@receiver(post_delete, sender=Favorites)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_recipe_counter(sender, instance, **kwargs):
+    sender.objects.update_counters([instance.recipe_id], -1)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, update_fields, **kwargs):
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        Recipe.objects.filter(pk=instance.pk).update_search_vector()
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: FeedEntry.objects.fan_out([instance]))
+
+
+def update_feed_mode_on_commit(author_id):
+    transaction.on_commit(lambda: FeedEntry.objects.update_mode(author_id))
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        FeedEntry.objects.backfill(instance.author_id, [instance.user_id])
+        update_feed_mode_on_commit(instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_feed(sender, instance, **kwargs):
+    FeedEntry.objects.trim(instance.user_id, instance.author_id)
+    update_feed_mode_on_commit(instance.author_id)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def bump_recipe_ingredient_version(sender, instance, **kwargs):
+    bump_on_commit(recipe_version_key(instance.recipe_id))
+
+
+@receiver(post_save, sender=User)
+def bump_user_version(sender, instance, **kwargs):
+    bump_on_commit(user_version_key(instance.pk))
+
+
+@receiver(post_save, sender=User)
+def revoke_cached_tokens(sender, instance, created, update_fields=None,
+                         **kwargs):
+    if created or update_fields is not None and (
+        set(update_fields) <= {'last_login'}
+    ):
+        return
+    keys = list(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
+    if keys:
+        transaction.on_commit(lambda: revoke_tokens(*keys))
+
+
+@receiver(post_delete, sender=Token)
+def revoke_cached_token(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: revoke_tokens(key))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=RecipeIngredient)
+def bump_recipe_relations_version(sender, instance, action, reverse, pk_set,
+                                  **kwargs):
+    if not action.startswith('post_'):
+        return
+    names = [sender._meta.db_table]
+    if not reverse:
+        names.append(recipe_version_key(instance.pk))
+    elif pk_set:
+        names.extend(recipe_version_key(pk) for pk in pk_set)
+    else:
+        names.append(instance._meta.db_table)
+    bump_on_commit(*names)
+
+
+def recipes_with_tag_bit(bit):
+    return Recipe.objects.alias(
+        tag_match=F('tags_mask').bitand(1 << bit)
+    ).filter(tag_match__gt=0)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_recipe_tags_mask(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Recipe.objects.filter(pk=instance.pk).update_tags_mask()
+    elif pk_set:
+        Recipe.objects.filter(pk__in=pk_set).update_tags_mask()
+    elif action == 'post_clear' and instance.bit is not None:
+        recipes_with_tag_bit(instance.bit).update_tags_mask()
+
+
+@receiver(post_delete, sender=Tag)
+def remove_tag_from_masks(sender, instance, **kwargs):
+    if instance.bit is not None:
+        recipes_with_tag_bit(instance.bit).update_tags_mask()
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_cart_to_shopping_list(sender, instance, **kwargs):
+    stored = instance.stored_row
+    if stored is not None:
+        if (stored.user_id, stored.recipe_id) == (
+            instance.user_id, instance.recipe_id
+        ):
+            return
+        ShoppingListItem.objects.remove_recipes(
+            stored.user_id, [stored.recipe_id]
+        )
+    ShoppingListItem.objects.add_recipes(
+        instance.user_id, [instance.recipe_id]
+    )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_cart_from_shopping_list(sender, instance, **kwargs):
+    ShoppingListItem.objects.remove_recipes(
+        instance.user_id, [instance.recipe_id]
+    )
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_shopping_lists(sender, instance, **kwargs):
+    stored = instance.stored_row
+    old_amounts = {}
+    if stored is not None and stored.recipe_id != instance.recipe_id:
+        remove_ingredient_from_shopping_lists(sender, stored)
+    elif stored is not None:
+        old_amounts = {stored.ingredient_id: stored.amount}
+    ShoppingListItem.objects.change_recipe(
+        instance.recipe_id,
+        old_amounts,
+        {instance.ingredient_id: instance.amount},
+    )
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def remove_ingredient_from_shopping_lists(sender, instance, **kwargs):
+    ShoppingListItem.objects.change_recipe(
+        instance.recipe_id, {instance.ingredient_id: instance.amount}, {}
+    )
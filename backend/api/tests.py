@@ -0,0 +1,572 @@
+from base64 import b64encode
+from io import BytesIO
+from time import sleep
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from foodgram.middleware import ReplicaRoutingMiddleware
+from foodgram.routers import (ReplicaPool, ReplicaRouter, replicas,
+                              use_primary, use_replica)
+from recipes.models import (Favorites, FeedEntry, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag)
+from users.models import Follow, User
+from .authentication import revoke_tokens, token_cache
+from .cache import bump_versions
+from .fields import Base64ImageField
+from .matching import recipe_match_index
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+ESTIMATE_QUERIES = int(connection.vendor == 'postgresql')
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='password-123',
+        first_name='Имя',
+        last_name='Фамилия',
+    )
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class RecipeTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = create_user('viewer')
+        cls.token = Token.objects.create(user=cls.viewer)
+        authors = [create_user(f'author{number}') for number in range(3)]
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}',
+            )
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(4)
+        ]
+        for number in range(12):
+            recipe = Recipe.objects.create(
+                author=authors[number % 3],
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image='recipes/image.png',
+            )
+            recipe.tags.set(tags[:number % 3 + 1])
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=100)
+                for ingredient in ingredients[:number % 4 + 1]
+            ])
+            if number % 2:
+                Favorites.objects.create(user=cls.viewer, recipe=recipe)
+            if number % 3:
+                ShoppingCart.objects.create(user=cls.viewer, recipe=recipe)
+        Follow.objects.create(user=cls.viewer, author=authors[0])
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+
+class RecipeListQueriesTest(RecipeTestCase):
+
+    def test_page_cold_cache(self):
+        with self.assertNumQueries(7 + ESTIMATE_QUERIES):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(response.data['count'], 12)
+
+    def test_page_warm_cache(self):
+        self.client.get('/api/recipes/')
+        with self.assertNumQueries(2 + ESTIMATE_QUERIES):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        with self.assertNumQueries(7 + ESTIMATE_QUERIES):
+            response = self.client.get('/api/recipes/?limit=12')
+        self.assertEqual(len(response.data['results']), 12)
+
+    def test_filtered_count_is_shared_between_viewers(self):
+        self.client.get('/api/recipes/?tags=tag0')
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION='Token {}'.format(
+            Token.objects.create(user=create_user('other'))
+        ))
+        with CaptureQueriesContext(connection) as context:
+            response = other.get('/api/recipes/?tags=tag0')
+        self.assertEqual(response.data['count'], 12)
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in context.captured_queries
+        ))
+
+    def test_viewer_flags(self):
+        results = self.client.get('/api/recipes/?limit=12').data['results']
+        recipes = {recipe['name']: recipe for recipe in results}
+        for number in range(12):
+            recipe = recipes[f'Рецепт {number}']
+            self.assertEqual(recipe['is_favorited'], bool(number % 2))
+            self.assertEqual(recipe['is_in_shopping_cart'], bool(number % 3))
+            self.assertEqual(
+                recipe['author']['is_subscribed'], number % 3 == 0
+            )
+
+
+class KeysetPaginationTest(RecipeTestCase):
+
+    def walk(self, url, link):
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            names.append(
+                [recipe['name'] for recipe in response.data['results']]
+            )
+            url = response.data[link]
+        return names
+
+    def test_pages_cover_all_recipes_in_order(self):
+        expected = list(Recipe.objects.values_list('name', flat=True))
+        pages = self.walk('/api/recipes/?cursor=&limit=5', 'next')
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_previous_links_walk_back(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=5')
+        last = self.client.get(
+            self.client.get(response.data['next']).data['next']
+        )
+        pages = self.walk(last.data['previous'], 'previous')
+        self.assertEqual(
+            sum(reversed(pages), []),
+            list(Recipe.objects.values_list('name', flat=True)[:10]),
+        )
+
+    def test_cursor_past_last_row_returns_empty_page(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=5')
+        next_url = response.data['next']
+        Recipe.objects.exclude(
+            name__in=[recipe['name'] for recipe in response.data['results']]
+        ).delete()
+        response = self.client.get(next_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNone(response.data['previous'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=broken')
+        self.assertEqual(response.status_code, 404)
+
+
+class RecipeMatchIndexTest(RecipeTestCase):
+
+    def matched(self, ingredient):
+        return [
+            recipe_id
+            for recipe_id, _ in recipe_match_index.rank([ingredient.id])
+        ]
+
+    def test_index_follows_recipe_ingredient_writes(self):
+        recipe_match_index.load({})
+        recipe = Recipe.objects.get(name='Рецепт 0')
+        ingredient = Ingredient.objects.create(
+            name='Новый продукт', measurement_unit='г'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=5
+            )
+        self.assertEqual(self.matched(ingredient), [recipe.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient=ingredient
+            ).delete()
+        self.assertEqual(self.matched(ingredient), [])
+
+    def test_index_rebuilds_when_version_changes_elsewhere(self):
+        recipe_match_index.refresh()
+        recipe = Recipe.objects.get(name='Рецепт 0')
+        ingredient = Ingredient.objects.create(
+            name='Новый продукт', measurement_unit='г'
+        )
+        RecipeIngredient.objects.bulk_create([RecipeIngredient(
+            recipe=recipe, ingredient=ingredient, amount=5
+        )])
+        bump_versions(RecipeIngredient._meta.db_table)
+        self.assertEqual(
+            [recipe_id for recipe_id, _ in recipe_match_index.match(
+                [ingredient.id]
+            )],
+            [recipe.id],
+        )
+
+
+class RecipeToggleTest(RecipeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = Recipe.objects.get(name='Рецепт 0')
+        self.ingredient = Ingredient.objects.get(name='Продукт 0')
+
+    def counters(self, *names):
+        return list(Recipe.objects.filter(name__in=names).order_by(
+            'name'
+        ).values_list('favorites_count', 'in_carts_count'))
+
+    def shopping_list(self, user=None):
+        return dict(ShoppingListItem.objects.filter(
+            user=user or self.viewer
+        ).values_list('ingredient__name', 'amount'))
+
+    def test_favorite_toggle_responses(self):
+        url = f'/api/recipes/{self.recipe.id}/favorite/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.counters('Рецепт 0'), [(1, 0)])
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.assertEqual(self.counters('Рецепт 0'), [(0, 0)])
+        self.assertEqual(
+            self.client.post('/api/recipes/0/favorite/').status_code, 404
+        )
+
+    def test_shopping_cart_toggle_updates_shopping_list(self):
+        url = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        before = self.shopping_list()
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.counters('Рецепт 0'), [(0, 1)])
+        self.assertEqual(
+            self.shopping_list()['Продукт 0'], before['Продукт 0'] + 100
+        )
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.counters('Рецепт 0'), [(0, 0)])
+        self.assertEqual(self.shopping_list(), before)
+
+    def test_batch_updates_counters(self):
+        first, second, third = Recipe.objects.filter(
+            name__in=('Рецепт 0', 'Рецепт 1', 'Рецепт 2')
+        ).order_by('name').values_list('id', flat=True)
+        response = self.client.post('/api/recipes/favorite/', {
+            'recipes': [first, second, third]
+        }, format='json')
+        self.assertEqual(response.data['added'], [first, third])
+        self.assertEqual(
+            self.counters('Рецепт 0', 'Рецепт 1', 'Рецепт 2'),
+            [(1, 0), (1, 1), (1, 1)],
+        )
+        response = self.client.delete('/api/recipes/favorite/', {
+            'recipes': [second, third]
+        }, format='json')
+        self.assertEqual(response.data['removed'], [second, third])
+        self.assertEqual(
+            self.counters('Рецепт 0', 'Рецепт 1', 'Рецепт 2'),
+            [(1, 0), (0, 1), (0, 1)],
+        )
+
+    def test_cascade_delete_updates_counters(self):
+        user = create_user('other')
+        Favorites.objects.create(user=user, recipe=self.recipe)
+        ShoppingCart.objects.create(user=user, recipe=self.recipe)
+        self.assertEqual(self.counters('Рецепт 0'), [(1, 1)])
+        user.delete()
+        self.assertEqual(self.counters('Рецепт 0'), [(0, 0)])
+
+    def test_ingredient_edit_updates_shopping_lists(self):
+        user = create_user('other')
+        ShoppingCart.objects.create(user=user, recipe=self.recipe)
+        self.assertEqual(self.shopping_list(user), {'Продукт 0': 100})
+        row = RecipeIngredient.objects.get(recipe=self.recipe)
+        row.amount = 250
+        row.save()
+        self.assertEqual(self.shopping_list(user), {'Продукт 0': 250})
+        RecipeIngredient.objects.create(
+            recipe=self.recipe,
+            ingredient=Ingredient.objects.get(name='Продукт 1'),
+            amount=30,
+        )
+        self.assertEqual(
+            self.shopping_list(user), {'Продукт 0': 250, 'Продукт 1': 30}
+        )
+        row.delete()
+        self.assertEqual(self.shopping_list(user), {'Продукт 1': 30})
+        self.recipe.delete()
+        self.assertEqual(self.shopping_list(user), {})
+
+
+@override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+class FeedFanOutModeTest(RecipeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.get(username='author0')
+        self.recipes = list(Recipe.objects.filter(
+            author=self.author
+        ).order_by('-id').values_list('id', flat=True))
+
+    def feed(self):
+        return [
+            recipe['id']
+            for recipe in self.client.get('/api/recipes/feed/').data[
+                'results'
+            ]
+        ]
+
+    def follow(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Follow.objects.create(
+                user=create_user('follower'), author=self.author
+            )
+
+    def test_author_over_threshold_is_pulled(self):
+        self.follow()
+        self.author.refresh_from_db()
+        self.assertTrue(self.author.pull_feed)
+        self.assertFalse(FeedEntry.objects.filter(author=self.author))
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.feed(), self.recipes)
+        self.assertFalse(any(
+            'OFFSET' in query['sql'] for query in context.captured_queries
+        ))
+
+    def test_author_back_under_threshold_is_backfilled(self):
+        follow = self.follow()
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.delete()
+        self.author.refresh_from_db()
+        self.assertFalse(self.author.pull_feed)
+        self.assertEqual(
+            sorted(FeedEntry.objects.filter(
+                user=self.viewer
+            ).values_list('recipe_id', flat=True), reverse=True),
+            self.recipes,
+        )
+        self.assertEqual(self.feed(), self.recipes)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ReplicaRoutingMiddlewareTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.response = HttpResponse()
+        self.middleware = ReplicaRoutingMiddleware(self.get_response)
+        patcher = mock.patch.object(
+            replicas, 'choose', return_value='replica'
+        )
+        self.choose = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_response(self, request):
+        self.routed = ReplicaRouter().db_for_read(Recipe)
+        return self.response
+
+    def send(self, method, token=None, session=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        request = getattr(self.factory, method)('/api/recipes/', **headers)
+        if session:
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = session
+        self.middleware(request)
+        self.response = HttpResponse()
+        return self.routed
+
+    def test_new_session_is_pinned_after_login(self):
+        self.response.set_cookie(settings.SESSION_COOKIE_NAME, 'new-session')
+        self.send('post')
+        self.assertEqual(self.send('get', session='new-session'), 'default')
+        self.assertEqual(self.send('get', session='other'), 'replica')
+
+    def test_issued_token_is_pinned_after_login(self):
+        self.response.data = {'auth_token': 'issued'}
+        self.send('post')
+        self.assertEqual(self.send('get', 'issued'), 'default')
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.send('get'), 'replica')
+        self.assertEqual(self.send('head', 'reader'), 'replica')
+
+    def test_writes_go_to_primary(self):
+        for method in ('post', 'put', 'patch', 'delete', 'options'):
+            self.assertEqual(self.send(method, 'writer'), 'default')
+
+    def test_reads_stick_to_primary_after_write(self):
+        self.send('post', 'writer')
+        self.assertEqual(self.send('get', 'writer'), 'default')
+        self.assertEqual(self.send('get', 'reader'), 'replica')
+        self.assertEqual(self.send('get'), 'replica')
+
+    def test_stickiness_expires(self):
+        with override_settings(REPLICA_STICKY_SECONDS=0.01):
+            self.send('post', 'writer')
+        sleep(0.05)
+        self.assertEqual(self.send('get', 'writer'), 'replica')
+
+    def test_no_healthy_replica_falls_back_to_primary(self):
+        self.choose.return_value = None
+        self.assertEqual(self.send('get'), 'default')
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+        with use_replica('replica'):
+            self.assertEqual(router.db_for_read(Recipe), 'replica')
+            self.assertEqual(router.db_for_read(Token), 'default')
+            self.assertEqual(router.db_for_read(Session), 'default')
+            self.assertEqual(router.db_for_write(Recipe), 'default')
+            with use_primary():
+                self.assertEqual(router.db_for_read(Recipe), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'recipes'))
+
+
+class ReplicaPoolTest(TestCase):
+
+    def test_healthy_replica_is_chosen(self):
+        self.assertEqual(ReplicaPool(['default']).choose(), 'default')
+
+    def test_lagging_replica_is_skipped(self):
+        pool = ReplicaPool(['default'])
+        with mock.patch.object(
+            pool, 'lag', return_value=settings.REPLICA_MAX_LAG_SECONDS + 1
+        ):
+            self.assertIsNone(pool.choose())
+
+    def test_unreachable_replica_is_skipped(self):
+        pool = ReplicaPool(['default'])
+        with mock.patch.object(pool, 'lag', side_effect=DatabaseError):
+            self.assertIsNone(pool.choose())
+
+    def test_reads_inside_transaction_use_primary(self):
+        with use_replica('replica'):
+            self.assertEqual(ReplicaRouter().db_for_read(Recipe), 'default')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CachedTokenAuthenticationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = create_user('member')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def me(self, token_queries):
+        with CaptureQueriesContext(connection) as context:
+            status_code = self.client.get('/api/users/me/').status_code
+        self.assertEqual(token_queries, sum(
+            Token._meta.db_table in query['sql']
+            for query in context.captured_queries
+        ))
+        return status_code
+
+    def test_repeated_requests_skip_token_query(self):
+        self.assertEqual(self.me(1), 200)
+        self.assertEqual(self.me(0), 200)
+
+    def test_logout_revokes_cached_token(self):
+        self.me(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/auth/token/logout/')
+        self.assertEqual(self.me(1), 401)
+
+    def test_password_change_revokes_cached_token(self):
+        self.me(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/users/set_password/', {
+                'current_password': 'password-123',
+                'new_password': 'another-password-456',
+            }, format='json')
+        self.assertEqual(self.me(1), 200)
+
+    def test_deactivation_revokes_cached_token(self):
+        self.me(1)
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.me(1), 401)
+
+    def test_unknown_tokens_leave_no_cache_entries(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token unknown')
+        with mock.patch('api.authentication.cache') as shared:
+            shared.get.return_value = None
+            self.assertEqual(self.me(1), 401)
+        shared.set.assert_not_called()
+        shared.set_many.assert_not_called()
+
+    def test_invalidation_during_lookup_is_not_cached_as_fresh(self):
+        authenticate = TokenAuthentication.authenticate_credentials
+
+        def revoke_during_lookup(auth, key):
+            result = authenticate(auth, key)
+            revoke_tokens(key)
+            return result
+
+        with mock.patch.object(
+            TokenAuthentication, 'authenticate_credentials',
+            revoke_during_lookup,
+        ):
+            self.me(1)
+        self.assertEqual(self.me(1), 200)
+
+
+class ImageSerializer(serializers.Serializer):
+    image = Base64ImageField()
+
+
+class Base64ImageFieldTest(SimpleTestCase):
+
+    def validate(self, content):
+        serializer = ImageSerializer(data={
+            'image': 'data:image/png;base64,' + b64encode(content).decode()
+        })
+        serializer.is_valid()
+        return serializer
+
+    def png(self):
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4)).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_valid_image_is_accepted(self):
+        serializer = self.validate(self.png())
+        self.assertTrue(
+            serializer.validated_data['image'].name.endswith('.png')
+        )
+
+    def test_corrupt_image_with_valid_signature_is_rejected(self):
+        serializer = self.validate(b'\x89PNG\r\n\x1a\n' + b'garbage' * 10)
+        self.assertEqual(
+            serializer.errors['image'], [Base64ImageField.INVALID_FILE_MESSAGE]
+        )
+
+    def test_unknown_format_is_rejected(self):
+        serializer = self.validate(b'plain text')
+        self.assertEqual(
+            serializer.errors['image'], [Base64ImageField.INVALID_TYPE_MESSAGE]
+        )
@@ -0,0 +1,211 @@
+import json
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from recipes.images import schedule_image_variants
+from recipes.models import (FeedEntry, Ingredient, Recipe, RecipeIngredient,
+                            Tag)
+from users.models import User
+from .matching import recipe_match_index
+from .serializers import RecipeImportSerializer
+from .signals import bump_on_commit
+
+RecipeTag = Recipe.tags.through
+
+
+def export_recipes(batch_size=settings.RECIPE_TRANSFER_BATCH_SIZE):
+    last_id = 0
+    while True:
+        batch = list(Recipe.objects.with_related().filter(
+            id__gt=last_id
+        ).order_by('id')[:batch_size])
+        if not batch:
+            return
+        for recipe in batch:
+            yield json.dumps({
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'author': recipe.author.username,
+                'image': recipe.image.name,
+                'tags': [tag.slug for tag in recipe.tags.all()],
+                'ingredients': [
+                    {
+                        'name': row.ingredient.name,
+                        'measurement_unit': row.ingredient.measurement_unit,
+                        'amount': row.amount,
+                    }
+                    for row in recipe.ingredient_list.all()
+                ],
+            }, ensure_ascii=False) + '\n'
+        last_id = batch[-1].id
+
+
+def import_recipes(lines, default_author=None,
+                   batch_size=settings.RECIPE_TRANSFER_BATCH_SIZE):
+    report = {'created': 0, 'errors': []}
+    batch = []
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                report['errors'].append(
+                    {'line': number, 'errors': 'Строка не в кодировке UTF-8.'}
+                )
+                continue
+        if not line.strip():
+            continue
+        batch.append((number, line))
+        if len(batch) >= batch_size:
+            import_batch(batch, default_author, report)
+            batch = []
+    if batch:
+        import_batch(batch, default_author, report)
+    report['errors'].sort(key=lambda error: error['line'])
+    return report
+
+
+def validate_lines(lines, report):
+    rows = []
+    for number, line in lines:
+        try:
+            data = json.loads(line)
+        except ValueError:
+            report['errors'].append(
+                {'line': number, 'errors': 'Некорректный JSON.'}
+            )
+            continue
+        serializer = RecipeImportSerializer(data=data)
+        if serializer.is_valid():
+            rows.append((number, serializer.validated_data))
+        else:
+            report['errors'].append(
+                {'line': number, 'errors': serializer.errors}
+            )
+    return rows
+
+
+def resolve_rows(rows, default_author, report):
+    tags = dict(Tag.objects.filter(slug__in={
+        slug for _, row in rows for slug in row['tags']
+    }).values_list('slug', 'id'))
+    wanted = {
+        (ingredient['name'], ingredient['measurement_unit'])
+        for _, row in rows for ingredient in row['ingredients']
+    }
+    ingredients = {
+        (name, unit): ingredient_id
+        for ingredient_id, name, unit in Ingredient.objects.filter(
+            name__in={name for name, _ in wanted},
+            measurement_unit__in={unit for _, unit in wanted},
+        ).values_list('id', 'name', 'measurement_unit')
+        if (name, unit) in wanted
+    }
+    authors = dict(User.objects.filter(username__in={
+        row['author'] for _, row in rows if 'author' in row
+    }).values_list('username', 'id'))
+
+    resolved = []
+    for number, row in rows:
+        errors = {}
+        if 'author' in row:
+            author_id = authors.get(row['author'])
+        else:
+            author_id = getattr(default_author, 'id', None)
+        if author_id is None:
+            errors['author'] = [
+                'Пользователь {} не найден.'.format(row.get('author', ''))
+            ]
+        missing = [slug for slug in row['tags'] if slug not in tags]
+        if missing:
+            errors['tags'] = [f'Тег {slug} не найден.' for slug in missing]
+        missing = [
+            ingredient for ingredient in row['ingredients']
+            if (ingredient['name'], ingredient['measurement_unit'])
+            not in ingredients
+        ]
+        if missing:
+            errors['ingredients'] = [
+                'Ингредиент {}, {} не найден.'.format(
+                    ingredient['name'], ingredient['measurement_unit']
+                )
+                for ingredient in missing
+            ]
+        if errors:
+            report['errors'].append({'line': number, 'errors': errors})
+            continue
+        resolved.append((
+            number,
+            Recipe(
+                author_id=author_id,
+                name=row['name'],
+                text=row['text'],
+                cooking_time=row['cooking_time'],
+                image=row['image'],
+            ),
+            dict.fromkeys(tags[slug] for slug in row['tags']),
+            {
+                ingredients[(
+                    ingredient['name'], ingredient['measurement_unit']
+                )]: ingredient['amount']
+                for ingredient in row['ingredients']
+            },
+        ))
+    return resolved
+
+
+def write_recipes(resolved):
+    recipes = [recipe for _, recipe, _, _ in resolved]
+    if connection.features.can_return_rows_from_bulk_insert:
+        Recipe.objects.bulk_create(recipes)
+        Recipe.objects.filter(
+            id__in=[recipe.id for recipe in recipes]
+        ).update_search_vector()
+        bump_on_commit(Recipe._meta.db_table)
+        transaction.on_commit(lambda: [
+            schedule_image_variants(recipe) for recipe in recipes
+        ])
+        transaction.on_commit(lambda: FeedEntry.objects.fan_out(recipes))
+        transaction.on_commit(lambda: recipe_match_index.update_recipes(
+            [recipe.id for recipe in recipes]
+        ))
+    else:
+        for recipe in recipes:
+            recipe.save()
+    RecipeTag.objects.bulk_create([
+        RecipeTag(recipe_id=recipe.id, tag_id=tag_id)
+        for _, recipe, tag_ids, _ in resolved
+        for tag_id in tag_ids
+    ])
+    Recipe.objects.filter(
+        id__in=[recipe.id for recipe in recipes]
+    ).update_tags_mask()
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(
+            recipe_id=recipe.id, ingredient_id=ingredient_id, amount=amount
+        )
+        for _, recipe, _, amounts in resolved
+        for ingredient_id, amount in amounts.items()
+    ])
+    bump_on_commit(RecipeTag._meta.db_table, RecipeIngredient._meta.db_table)
+
+
+def import_batch(lines, default_author, report):
+    rows = validate_lines(lines, report)
+    if not rows:
+        return
+    resolved = resolve_rows(rows, default_author, report)
+    if not resolved:
+        return
+    try:
+        with transaction.atomic():
+            write_recipes(resolved)
+    except DatabaseError as error:
+        report['errors'].extend(
+            {'line': number, 'errors': str(error)}
+            for number, _, _, _ in resolved
+        )
+        return
+    report['created'] += len(resolved)
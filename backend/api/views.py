@@ -1,42 +1,109 @@
-from django.db.models import F
+from hashlib import md5
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import Count, F, Prefetch, prefetch_related_objects
+from django.http import (Http404, HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import (SAFE_METHODS, IsAdminUser,
+                                        IsAuthenticated)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 
-from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+from foodgram.routers import use_primary
+from recipes.models import (Favorites, FeedEntry, Ingredient, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
 from users.models import Follow, User
+from .authentication import token_cache
+from .cache import get_versions
+from .fragments import recipe_fragments
 from .filters import IngredientFilter, RecipeFilter
+from .matching import recipe_match_index
 from .paginators import PageLimitPagination
+from .parsers import MultiPartJSONParser
 from .permissions import IsOwnerOrReadOnly
-from .serializers import (FavoriteSerializer, FollowSerializer,
-                          IngredientSerializer, RecipeCreateSerializer,
-                          RecipeSerializer, ShoppingListSerializer,
-                          SubscribeListSerializer, TagSerializer,
-                          UserSerializer)
+from .search import ingredient_index
+from .serializers import (FollowSerializer, IngredientSerializer,
+                          RecipeCreateSerializer, RecipeIdsSerializer,
+                          RecipeSerializer, SubscribeListSerializer,
+                          TagSerializer, UserSerializer)
+from .shopping_list import SHOPPING_LIST_FORMATS
+from .transfer import export_recipes, import_recipes
+
 
+class CatalogCacheMixin:
+    catalog_cache = {}
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        table = self.queryset.model._meta.db_table
+        version = get_versions(table)[table]
+        cached = self.catalog_cache.get(table)
+        if cached is None or cached[0] != version:
+            with use_primary():
+                content = JSONRenderer().render(
+                    self.get_serializer(self.get_queryset(), many=True).data
+                )
+            cached = (version, f'"{md5(content).hexdigest()}"', content)
+            self.catalog_cache[table] = cached
+        _, etag, content = cached
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagsViewSet(CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit', '')
+        return Response(ingredient_index.search(
+            name, int(limit) if limit.isdigit() else None
+        ))
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     pagination_class = PageLimitPagination
     filterset_class = RecipeFilter
     permission_classes = (IsOwnerOrReadOnly,)
+    parser_classes = (JSONParser, MultiPartJSONParser)
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return Recipe.objects.with_user_flags(self.request.user)
+        return super().get_queryset()
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
@@ -49,35 +116,147 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def favorite(self, request, pk):
-        return self.process_request(Favorites, request.user, pk,
-                                    FavoriteSerializer)
+        return self.process_request(Favorites, request.user, pk)
 
     @action(
         detail=True,
         methods=['post', 'delete'],
         permission_classes=(IsAuthenticated,)
     )
+    @transaction.atomic
     def shopping_cart(self, request, pk):
-        return self.process_request(ShoppingCart, request.user, pk,
-                                    ShoppingListSerializer)
+        response = self.process_request(ShoppingCart, request.user, pk)
+        if request.method == 'DELETE':
+            ShoppingListItem.objects.remove_recipes(request.user.id, [pk])
+        else:
+            ShoppingListItem.objects.add_recipes(request.user.id, [pk])
+        return response
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=(IsAuthenticated,),
+        url_path='favorite',
+    )
+    def favorite_batch(self, request):
+        return self.process_batch(Favorites, request)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=(IsAuthenticated,),
+        url_path='shopping_cart',
+    )
+    @transaction.atomic
+    def shopping_cart_batch(self, request):
+        response = self.process_batch(ShoppingCart, request)
+        if request.method == 'DELETE':
+            ShoppingListItem.objects.remove_recipes(
+                request.user.id, response.data['removed']
+            )
+        else:
+            ShoppingListItem.objects.add_recipes(
+                request.user.id, response.data['added']
+            )
+        return response
+
+    def process_batch(self, model, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'DELETE':
+            return Response({
+                'removed': model.objects.remove_many(request.user, recipe_ids)
+            })
+        return Response({
+            'added': model.objects.add_many(request.user, recipe_ids)
+        })
 
-    def process_request(self, model, user, pk, serializer_class):
+    def process_request(self, model, user, pk):
+        if not pk.isdigit():
+            raise Http404
         if self.request.method == 'DELETE':
-            get_object_or_404(model, user=user, recipe__id=pk).delete()
+            if not model.objects.remove_one(user, int(pk)):
+                raise Http404
             return Response(status=status.HTTP_204_NO_CONTENT)
-        data = {
-            'user': user.id,
-            'recipe': pk
-        }
-        serializer_instance = serializer_class(
-            data=data,
-            context={'request': self.request}
-        )
-        serializer_instance.is_valid(raise_exception=True)
-        serializer_instance.save(user=user, recipe_id=pk)
-        return Response(serializer_instance.data,
+        found, added = model.objects.add_one(user, int(pk))
+        if not found:
+            raise Http404
+        if not added:
+            raise ValidationError({
+                'errors': 'Рецепт уже есть в разделе «{}».'.format(
+                    model._meta.verbose_name
+                )
+            })
+        return Response({'user': user.id, 'recipe': int(pk)},
                         status=status.HTTP_201_CREATED)
 
+    @staticmethod
+    def parse_ids(request, param):
+        values = [
+            value.strip()
+            for raw in request.query_params.getlist(param)
+            for value in raw.split(',') if value.strip()
+        ]
+        if not all(value.isdigit() for value in values):
+            raise ValidationError(
+                {param: 'Укажите идентификаторы ингредиентов через запятую.'}
+            )
+        return {int(value) for value in values}
+
+    @action(detail=False)
+    def match(self, request):
+        ingredient_ids = self.parse_ids(request, 'ingredients')
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': 'Укажите хотя бы один ингредиент.'}
+            )
+        limit = request.query_params.get('limit', '')
+        limit = int(limit) if limit.isdigit() else 0
+        matches = recipe_match_index.match(
+            ingredient_ids,
+            self.parse_ids(request, 'exclude'),
+            limit=min(limit or api_settings.PAGE_SIZE,
+                      settings.RECIPE_MATCH_MAX_RESULTS),
+        )
+        missing = dict(matches)
+        recipes = sorted(
+            Recipe.objects.with_user_flags(request.user).filter(
+                id__in=missing
+            ),
+            key=lambda recipe: (missing[recipe.id], recipe.id),
+        )
+        results = RecipeSerializer(
+            recipes, many=True, context={'request': request}
+        ).data
+        for recipe in results:
+            recipe['missing_ingredients'] = missing[recipe['id']]
+        return Response(results)
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        before = request.query_params.get('before', '')
+        limit = request.query_params.get('limit', '')
+        limit = int(limit) if limit.isdigit() else 0
+        limit = limit or api_settings.PAGE_SIZE
+        recipe_ids = FeedEntry.objects.recipe_ids(
+            request.user,
+            before=int(before) if before.isdigit() else None,
+            limit=limit + 1,
+        )
+        recipes = Recipe.objects.with_user_flags(request.user).filter(
+            id__in=recipe_ids[:limit]
+        ).order_by('-id')
+        serializer = RecipeSerializer(
+            recipes, many=True, context={'request': request}
+        )
+        next_link = None
+        if len(recipe_ids) > limit:
+            next_link = replace_query_param(
+                request.build_absolute_uri(), 'before', recipe_ids[limit - 1]
+            )
+        return Response({'next': next_link, 'results': serializer.data})
+
     @action(
         detail=False,
         methods=['GET'],
@@ -85,27 +264,56 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def download_shopping_cart(self, request):
         user = request.user
-        file_name = f'{user.username}_shopping_list.txt'
-        shopping_list = 'Список покупок:'
-
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shoppingcart__user=user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(
-            amount=F('amount')
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'file_format': 'Доступные форматы: {}'.format(
+                    ', '.join(SHOPPING_LIST_FORMATS)
+                )},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        content_type, render = SHOPPING_LIST_FORMATS[file_format]
+        ingredients = ShoppingListItem.objects.filter(user=user).values(
+            'amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        ).order_by('name')
+        response = StreamingHttpResponse(
+            render(ingredients.iterator()), content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename={user.username}_shopping_list.'
+            f'{file_format}'
         )
-        shopping_list += '\n'.join([
-            f"{ingredient['ingredient__name']} "
-            f"({ingredient['ingredient__measurement_unit']}) - "
-            f"{ingredient['amount']}"
-            for ingredient in ingredients
-        ])
-        response = Response(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename={file_name}'
-        ShoppingCart.objects.filter(user=user).delete()
         return response
 
+    @action(
+        detail=False,
+        methods=['GET'],
+        permission_classes=(IsAdminUser,),
+        url_path='export',
+    )
+    def export_ndjson(self, request):
+        response = StreamingHttpResponse(
+            export_recipes(), content_type='application/x-ndjson'
+        )
+        response['Content-Disposition'] = 'attachment; filename=recipes.ndjson'
+        return response
+
+    @action(
+        detail=False,
+        methods=['POST'],
+        permission_classes=(IsAdminUser,),
+        url_path='import',
+    )
+    def import_ndjson(self, request):
+        report = import_recipes(request.stream or (), request.user)
+        return Response(
+            report,
+            status=status.HTTP_201_CREATED if report['created']
+            else status.HTTP_400_BAD_REQUEST,
+        )
+
 
 class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
@@ -139,8 +347,20 @@ class CustomUserViewSet(UserViewSet):
     @action(detail=False, permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
         user = request.user
-        queryset = self.queryset.filter(following__user=user)
+        queryset = self.queryset.filter(following__user=user).annotate(
+            recipes_count=Count('recipes')
+        ).order_by('username')
         page = self.paginate_queryset(queryset)
+        recipes = Recipe.objects.all()
+        limit = request.query_params.get('recipes_limit', '')
+        if limit.isdigit():
+            recipes = recipes.top_per_author(
+                [author.id for author in page], int(limit)
+            )
+        prefetch_related_objects(
+            page,
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes'),
+        )
 
         serializer = SubscribeListSerializer(
             page,
@@ -149,3 +369,13 @@ class CustomUserViewSet(UserViewSet):
         )
 
         return self.get_paginated_response(serializer.data)
+
+
+class CacheStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({
+            'recipe_fragments': recipe_fragments.stats(),
+            'tokens': token_cache.stats(),
+        })
@@ -0,0 +1,55 @@
+from hashlib import sha1
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .routers import replicas, use_replica
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+def sticky_key(credentials):
+    return 'replica_sticky:' + sha1(credentials.encode()).hexdigest()
+
+
+def request_credentials(request):
+    return request.headers.get('Authorization') or request.COOKIES.get(
+        settings.SESSION_COOKIE_NAME
+    )
+
+
+def response_credentials(response):
+    credentials = []
+    cookie = response.cookies.get(settings.SESSION_COOKIE_NAME)
+    if cookie is not None and cookie.value:
+        credentials.append(cookie.value)
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict) and data.get('auth_token'):
+        credentials.append(f'Token {data["auth_token"]}')
+    return credentials
+
+
+class ReplicaRoutingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        credentials = request_credentials(request)
+        alias = None
+        if request.method in READ_METHODS and not (
+            credentials and cache.get(sticky_key(credentials))
+        ):
+            alias = replicas.choose()
+        with use_replica(alias):
+            response = self.get_response(request)
+        if request.method not in READ_METHODS:
+            written = response_credentials(response)
+            if credentials:
+                written.append(credentials)
+            if written:
+                cache.set_many(
+                    dict.fromkeys(map(sticky_key, written), True),
+                    settings.REPLICA_STICKY_SECONDS,
+                )
+        return response
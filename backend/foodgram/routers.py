@@ -0,0 +1,92 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+PRIMARY_ONLY_APPS = ('authtoken', 'django_cache', 'sessions')
+
+LAG_QUERIES = {
+    'postgresql': (
+        'SELECT CASE WHEN NOT pg_is_in_recovery() '
+        'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+        'ELSE COALESCE(EXTRACT(EPOCH FROM '
+        'now() - pg_last_xact_replay_timestamp()), 0) END'
+    ),
+}
+
+current_replica = ContextVar('current_replica', default=None)
+
+
+@contextmanager
+def use_replica(alias):
+    token = current_replica.set(alias)
+    try:
+        yield
+    finally:
+        current_replica.reset(token)
+
+
+def use_primary():
+    return use_replica(None)
+
+
+class ReplicaPool:
+
+    def __init__(self, aliases):
+        self.aliases = tuple(aliases)
+        self._lock = Lock()
+        self._checked = {alias: (float('-inf'), False) for alias in aliases}
+
+    def lag(self, alias):
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_QUERIES.get(connection.vendor, 'SELECT 0'))
+            return float(cursor.fetchone()[0] or 0)
+
+    def is_healthy(self, alias):
+        now = monotonic()
+        with self._lock:
+            checked_at, healthy = self._checked[alias]
+            if now - checked_at < settings.REPLICA_HEALTH_CHECK_INTERVAL:
+                return healthy
+            self._checked[alias] = (now, healthy)
+        try:
+            healthy = self.lag(alias) <= settings.REPLICA_MAX_LAG_SECONDS
+        except DatabaseError:
+            healthy = False
+        with self._lock:
+            self._checked[alias] = (now, healthy)
+        return healthy
+
+    def choose(self):
+        healthy = [alias for alias in self.aliases if self.is_healthy(alias)]
+        return random.choice(healthy) if healthy else None
+
+
+replicas = ReplicaPool(settings.DATABASE_REPLICAS)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = current_replica.get()
+        if (
+            alias is None
+            or model._meta.app_label in PRIMARY_ONLY_APPS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'foodgram.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -73,6 +74,37 @@ DATABASES = {
     }
 }
 
+DATABASE_REPLICAS = []
+for number, address in enumerate(
+    filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1
+):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['foodgram.routers.ReplicaRouter']
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -90,7 +122,7 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework.authentication.TokenAuthentication'],
+    'DEFAULT_AUTHENTICATION_CLASSES': ['api.authentication.CachedTokenAuthentication'],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -144,3 +176,21 @@ MIN_INGREDIENT_AMOUNT = 1
 MAX_INGREDIENT_AMOUNT = 3000
 REGEX_USERNAME = r'[\W]'
 INVALID_NAMES = ['me', 'admin', 'root']
+PAGINATION_COUNT_CACHE_TIMEOUT = 30
+PAGINATION_APPROXIMATE_COUNT_THRESHOLD = 10000
+RECIPE_FRAGMENT_CACHE_SIZE = 2000
+RECIPE_IMAGE_VARIANTS = {'card': 480, 'detail': 960, 'retina': 1920}
+RECIPE_IMAGE_WORKERS = 2
+RECIPE_TRANSFER_BATCH_SIZE = 500
+RECIPE_BATCH_MAX_SIZE = 100
+FEED_FANOUT_MAX_FOLLOWERS = 1000
+FEED_BACKFILL_SIZE = 100
+FEED_FANOUT_BATCH_SIZE = 1000
+RECIPE_SEARCH_CONFIG = 'russian'
+RECIPE_MATCH_INDEX_TTL = 300
+RECIPE_MATCH_MAX_RESULTS = 100
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+REPLICA_STICKY_SECONDS = 5
+REPLICA_MAX_LAG_SECONDS = 10
+REPLICA_HEALTH_CHECK_INTERVAL = 5
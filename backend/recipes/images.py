@@ -0,0 +1,110 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+PILLOW_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True,
+             'progressive': True},
+}
+
+_executor = None
+
+
+def sniff_image_type(header):
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def identify_image(file):
+    try:
+        with Image.open(file) as image:
+            return PILLOW_FORMATS.get(image.format)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.RECIPE_IMAGE_WORKERS,
+            thread_name_prefix='recipe-images',
+        )
+    return _executor
+
+
+def schedule_image_variants(recipe):
+    get_executor().submit(
+        build_image_variants_task, recipe.pk, recipe.image.name
+    )
+
+
+def build_image_variants_task(recipe_id, image_name):
+    try:
+        build_image_variants(recipe_id, image_name)
+    except Exception:
+        logger.exception(
+            'Не удалось обработать изображение рецепта %s', recipe_id
+        )
+    finally:
+        close_old_connections()
+
+
+def build_image_variants(recipe_id, image_name):
+    from .models import Recipe
+
+    recipe = Recipe.objects.filter(pk=recipe_id, image=image_name).first()
+    if recipe is None:
+        return
+    storage = recipe.image.storage
+    with storage.open(image_name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info
+                              else 'RGB')
+
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    variants = {'source': image_name}
+    for variant, width in settings.RECIPE_IMAGE_VARIANTS.items():
+        resized = image
+        if image.width > width:
+            resized = image.resize(
+                (width, round(image.height * width / image.width)),
+                Image.LANCZOS,
+            )
+        variants[variant] = {}
+        for image_format, options in SAVE_OPTIONS.items():
+            frame = resized
+            if image_format == 'jpeg' and frame.mode != 'RGB':
+                frame = frame.convert('RGB')
+            buffer = BytesIO()
+            frame.save(buffer, **options)
+            variants[variant][image_format] = storage.save(
+                f'recipes/variants/{stem}_{variant}.{image_format}',
+                ContentFile(buffer.getvalue()),
+            )
+
+    if Recipe.objects.filter(pk=recipe_id, image=image_name).exists():
+        recipe.image_variants = variants
+        recipe.save(update_fields=('image_variants',))
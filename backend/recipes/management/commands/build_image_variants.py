@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_image_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии фотографий рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать копии и для уже обработанных рецептов.',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').values_list(
+            'id', 'image', 'image_variants'
+        )
+        built = failed = 0
+        for recipe_id, image, variants in recipes.iterator():
+            if not options['force'] and variants.get('source') == image:
+                continue
+            try:
+                build_image_variants(recipe_id, image)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {recipe_id}: {error}')
+            else:
+                built += 1
+        self.stdout.write(f'Обработано: {built}, с ошибками: {failed}')
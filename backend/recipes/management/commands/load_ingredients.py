@@ -0,0 +1,156 @@
+import csv
+import io
+import json
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.cache import bump_versions
+from api.checks import PROCESS_LOCAL_CACHES
+from recipes.models import Ingredient
+
+CHUNK_SIZE = 64 * 1024
+DATA_DIR = settings.BASE_DIR.parent / 'data'
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+        elif row:
+            yield row[0], ''
+
+
+def read_json(file):
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n[,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                if buffer[position:].strip():
+                    raise CommandError('Некорректный JSON в файле.')
+                return
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        if not isinstance(item, dict):
+            raise CommandError('Ожидался массив объектов JSON.')
+        yield item.get('name', ''), item.get('measurement_unit', '')
+
+
+READERS = {'.csv': read_csv, '.json': read_json}
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON, пропуская уже существующие'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='ingredients.json')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Загружать через COPY во временную таблицу (PostgreSQL).',
+        )
+
+    def rows(self, path):
+        reader = READERS.get(path.suffix.lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json.')
+        max_length = Ingredient._meta.get_field('name').max_length
+        seen = set()
+        self.read = self.invalid = 0
+        with path.open(encoding='utf-8', newline='') as file:
+            for name, unit in reader(file):
+                self.read += 1
+                name, unit = str(name).strip(), str(unit).strip()
+                if not name or not unit or max(
+                    len(name), len(unit)
+                ) > max_length:
+                    self.invalid += 1
+                    continue
+                if (name, unit) not in seen:
+                    seen.add((name, unit))
+                    yield name, unit
+
+    def load_bulk(self, rows, batch_size):
+        before = Ingredient.objects.count()
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in batch],
+                ignore_conflicts=True,
+            )
+        return Ingredient.objects.count() - before
+
+    def load_copy(self, rows, batch_size):
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_staging '
+                '(name text, measurement_unit text) ON COMMIT DROP'
+            )
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    'COPY ingredient_staging FROM STDIN WITH (FORMAT csv)',
+                    buffer,
+                )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT name, measurement_unit FROM ingredient_staging '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            return cursor.rowcount
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.is_file():
+            path = DATA_DIR / path
+        if not path.is_file():
+            raise CommandError(f'Файл {path} не найден.')
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy доступен только для PostgreSQL.')
+        load = self.load_copy if options['copy'] else self.load_bulk
+
+        started = perf_counter()
+        with transaction.atomic():
+            inserted = load(self.rows(path), options['batch_size'])
+        elapsed = perf_counter() - started
+        if inserted:
+            bump_versions(Ingredient._meta.db_table)
+
+        self.stdout.write(
+            f'Прочитано строк: {self.read}, '
+            f'добавлено: {inserted}, '
+            f'пропущено: {self.read - inserted - self.invalid}, '
+            f'некорректных: {self.invalid}, '
+            f'время: {elapsed:.2f} с'
+        )
+        if inserted and settings.CACHES['default']['BACKEND'] in (
+            PROCESS_LOCAL_CACHES
+        ):
+            self.stdout.write(self.style.WARNING(
+                'Кэш не общий для процессов: перезапустите веб-сервер, '
+                'чтобы он увидел новые ингредиенты.'
+            ))
+        self.stdout.write(self.style.SUCCESS('Ингредиенты загружены.'))
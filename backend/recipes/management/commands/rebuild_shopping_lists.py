@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+
+from recipes.models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает списки покупок пользователей по их корзинам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сообщить о расхождениях, ничего не меняя.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user_ids = sorted(
+            set(ShoppingCart.objects.values_list('user_id', flat=True))
+            | set(ShoppingListItem.objects.values_list('user_id', flat=True))
+        )
+        batch_size = options['batch_size']
+        drifted = missing = stale = 0
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            with transaction.atomic():
+                expected = {
+                    (row['user_id'], row['ingredient_id']): row['total']
+                    for row in RecipeIngredient.objects.filter(
+                        recipe__shoppingcart__user_id__in=batch
+                    ).values(
+                        'ingredient_id',
+                        user_id=F('recipe__shoppingcart__user_id'),
+                    ).annotate(total=Sum('amount')).order_by()
+                }
+                items = {
+                    (item.user_id, item.ingredient_id): item
+                    for item in ShoppingListItem.objects.select_for_update(
+                    ).filter(user_id__in=batch)
+                }
+                created, updated = [], []
+                for key, total in expected.items():
+                    item = items.pop(key, None)
+                    if item is None:
+                        missing += 1
+                        created.append(ShoppingListItem(
+                            user_id=key[0], ingredient_id=key[1], amount=total
+                        ))
+                    elif item.amount != total:
+                        drifted += 1
+                        item.amount = total
+                        updated.append(item)
+                stale += len(items)
+                if options['check']:
+                    continue
+                ShoppingListItem.objects.bulk_create(created)
+                ShoppingListItem.objects.bulk_update(updated, ('amount',))
+                ShoppingListItem.objects.filter(
+                    pk__in=[item.pk for item in items.values()]
+                ).delete()
+
+        self.stdout.write(
+            f'Пользователей: {len(user_ids)}, '
+            f'неверных количеств: {drifted}, '
+            f'недостающих позиций: {missing}, '
+            f'лишних позиций: {stale}'
+        )
+        if options['check'] and (drifted or missing or stale):
+            self.stdout.write(self.style.WARNING(
+                'Найдены расхождения, запустите команду без --check.'
+            ))
+        elif not options['check']:
+            self.stdout.write(
+                self.style.SUCCESS('Списки покупок пересчитаны.')
+            )
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorites, Recipe, ShoppingCart
+
+COUNTED = {'favorites_count': Favorites, 'in_carts_count': ShoppingCart}
+
+
+def count_rows(model):
+    return Coalesce(Subquery(
+        model.objects.filter(recipe=OuterRef('pk')).order_by().values(
+            'recipe'
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики избранного и корзин у рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сообщить о расхождениях, ничего не меняя.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = drifted = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                recipes = list(Recipe.objects.filter(
+                    id__gt=last_id
+                ).order_by('id').select_for_update().only(
+                    'id', *COUNTED
+                ).annotate(**{
+                    f'actual_{field}': count_rows(model)
+                    for field, model in COUNTED.items()
+                })[:batch_size])
+                if not recipes:
+                    break
+                last_id = recipes[-1].id
+                checked += len(recipes)
+                changed = []
+                for recipe in recipes:
+                    stale = False
+                    for field in COUNTED:
+                        actual = getattr(recipe, f'actual_{field}')
+                        if getattr(recipe, field) != actual:
+                            setattr(recipe, field, actual)
+                            stale = True
+                    if stale:
+                        changed.append(recipe)
+                drifted += len(changed)
+                if not options['check']:
+                    Recipe.objects.bulk_update(changed, tuple(COUNTED))
+
+        self.stdout.write(
+            f'Рецептов: {checked}, с неверными счётчиками: {drifted}'
+        )
+        if options['check'] and drifted:
+            self.stdout.write(self.style.WARNING(
+                'Найдены расхождения, запустите команду без --check.'
+            ))
+        elif not options['check']:
+            self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны.'))
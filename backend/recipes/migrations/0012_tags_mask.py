@@ -0,0 +1,45 @@
+# Generated by Django 3.2.3 on 2026-10-18 06:09
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+MASK_BITS = 63
+
+
+def fill_tags_mask(apps, schema_editor):
+    Tag = apps.get_model('recipes', 'Tag')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    for bit, tag in enumerate(Tag.objects.order_by('id')[:MASK_BITS]):
+        Tag.objects.filter(pk=tag.pk).update(bit=bit)
+    masks = defaultdict(int)
+    for recipe_id, bit in Recipe.tags.through.objects.filter(
+        tag__bit__isnull=False
+    ).values_list('recipe_id', 'tag__bit').iterator():
+        masks[recipe_id] |= 1 << bit
+    recipe_ids = defaultdict(list)
+    for recipe_id, mask in masks.items():
+        recipe_ids[mask].append(recipe_id)
+    for mask, ids in recipe_ids.items():
+        Recipe.objects.filter(id__in=ids).update(tags_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_popularity_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска тегов'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, unique=True, verbose_name='Бит в маске тегов'),
+        ),
+        migrations.RunPython(fill_tags_mask, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,41 @@
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
+from django.core.cache import cache
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import connections, models, transaction
+from django.db.models import (Case, Exists, F, OuterRef, Prefetch, Q,
+                              UniqueConstraint, Value, When, Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from api.cache import bump_versions, get_versions
+from foodgram.routers import use_primary
+from users.models import Follow
 
 User = get_user_model()
 
 
+class TagQuerySet(models.QuerySet):
+
+    def bits(self):
+        table = self.model._meta.db_table
+        key = 'tag_bits:{}'.format(get_versions(table)[table])
+        bits = cache.get(key)
+        if bits is None:
+            with use_primary():
+                bits = dict(self.values_list('slug', 'bit'))
+            cache.set(key, bits, timeout=None)
+        return bits
+
+
 class Tag(models.Model):
     name = models.CharField(
         verbose_name='Название тега',
@@ -30,6 +58,16 @@ class Tag(models.Model):
         unique=True,
         max_length=settings.MAX_LEN_RECIPE_FIELD,
     )
+    bit = models.PositiveSmallIntegerField(
+        verbose_name='Бит в маске тегов',
+        unique=True,
+        null=True,
+        editable=False,
+    )
+
+    objects = TagQuerySet.as_manager()
+
+    MASK_BITS = 63
 
     class Meta:
         ordering = ('name',)
@@ -39,6 +77,17 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            taken = set(Tag.objects.exclude(bit=None).values_list(
+                'bit', flat=True
+            ))
+            self.bit = next(
+                (bit for bit in range(self.MASK_BITS) if bit not in taken),
+                None,
+            )
+        super().save(*args, **kwargs)
+
 
 class Ingredient(models.Model):
     name = models.CharField(
@@ -64,6 +113,108 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient_list',
+                queryset=RecipeIngredient.objects.select_related('ingredient'),
+            ),
+        )
+
+    def with_user_flags(self, user):
+        queryset = self.defer('search_vector')
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(Favorites.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+        )
+
+    def top_per_author(self, author_ids, limit):
+        ranked = self.model.objects.filter(author_id__in=author_ids).annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('name').asc(), F('id').asc()),
+            )
+        ).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(id__in=RawSQL(
+            f'SELECT id FROM ({sql}) ranked WHERE row_number <= %s',
+            (*params, limit),
+        ))
+
+    def update_tags_mask(self):
+        masks = dict.fromkeys(self.values_list('id', flat=True), 0)
+        for recipe_id, bit in Recipe.tags.through.objects.filter(
+            recipe_id__in=masks, tag__bit__isnull=False
+        ).values_list('recipe_id', 'tag__bit'):
+            masks[recipe_id] |= 1 << bit
+        recipe_ids = defaultdict(list)
+        for recipe_id, mask in masks.items():
+            recipe_ids[mask].append(recipe_id)
+        for mask, ids in recipe_ids.items():
+            self.model.objects.filter(id__in=ids).update(tags_mask=mask)
+        if masks:
+            table = self.model._meta.db_table
+            transaction.on_commit(lambda: bump_versions(table))
+
+    def with_tags(self, slugs):
+        bits = Tag.objects.bits()
+        mask = sum(
+            1 << bits[slug] for slug in slugs if bits.get(slug) is not None
+        )
+        condition = Q(tag_match__gt=0)
+        unmasked = [
+            slug for slug in slugs if slug in bits and bits[slug] is None
+        ]
+        if unmasked:
+            condition |= Q(id__in=Recipe.tags.through.objects.filter(
+                tag__slug__in=unmasked
+            ).values('recipe_id'))
+        return self.alias(
+            tag_match=F('tags_mask').bitand(mask)
+        ).filter(condition)
+
+    def update_search_vector(self):
+        if connections[self.db].vendor != 'postgresql':
+            return
+        config = settings.RECIPE_SEARCH_CONFIG
+        self.update(search_vector=(
+            SearchVector('name', weight='A', config=config)
+            + SearchVector('text', weight='B', config=config)
+        ))
+
+    def search(self, text):
+        if connections[self.db].vendor != 'postgresql':
+            return self.filter(
+                Q(name__icontains=text) | Q(text__icontains=text)
+            ).annotate(rank=Case(
+                When(name__icontains=text, then=Value(1.0)),
+                default=Value(0.5),
+                output_field=models.FloatField(),
+            )).order_by('-rank', 'id')
+        query = SearchQuery(
+            text, config=settings.RECIPE_SEARCH_CONFIG,
+            search_type='websearch',
+        )
+        return self.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', 'id')
+
+
 class Recipe(models.Model):
     name = models.CharField(
         verbose_name='Название рецепта',
@@ -80,6 +231,12 @@ class Recipe(models.Model):
         verbose_name='Фото рецепта',
         upload_to='recipes/'
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии фото',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     tags = models.ManyToManyField(
         Tag,
         related_name='recipes',
@@ -100,15 +257,57 @@ class Recipe(models.Model):
             message='Время приготовления не более 12 часов!'
         )]
     )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+    tags_mask = models.BigIntegerField(
+        verbose_name='Маска тегов',
+        default=0,
+        editable=False,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В корзинах',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    COUNTER_FIELDS = ('favorites_count', 'in_carts_count')
+    DERIVED_FIELDS = (
+        'image_variants', 'search_vector', 'tags_mask', *COUNTER_FIELDS
+    )
 
     class Meta:
         ordering = ('name',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            GinIndex(fields=('search_vector',), name='recipe_search_vector'),
+            models.Index(
+                fields=('-favorites_count', 'id'), name='recipe_popular'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name}. Автор: {self.author.username}'
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skipped = {*self.DERIVED_FIELDS, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped
+            ]
+        super().save(*args, **kwargs)
+
 
 class RecipeIngredient(models.Model):
     ingredient = models.ForeignKey(
@@ -149,6 +348,162 @@ class RecipeIngredient(models.Model):
         )
 
 
+class CartFavoritesQuerySet(models.QuerySet):
+
+    def bump_version(self):
+        table = self.model._meta.db_table
+        transaction.on_commit(lambda: bump_versions(table))
+
+    def update_counters(self, recipe_ids, delta):
+        field = self.model.counter_field
+        for count, chunk in groupby(
+            sorted(Counter(recipe_ids).items(), key=itemgetter(1)),
+            key=itemgetter(1),
+        ):
+            Recipe.objects.using(self.db).filter(
+                id__in=[recipe_id for recipe_id, _ in chunk]
+            ).update(**{field: F(field) + delta * count})
+
+    @transaction.atomic
+    def add_many(self, user, recipe_ids):
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        recipes = connection.ops.quote_name(Recipe._meta.db_table)
+        inserted = set()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f'INSERT INTO {table} (user_id, recipe_id)'
+                    f' SELECT %s, id FROM {recipes} WHERE id = ANY(%s)'
+                    ' ON CONFLICT (user_id, recipe_id) DO NOTHING'
+                    ' RETURNING recipe_id',
+                    [user.id, recipe_ids],
+                )
+                inserted.update(row[0] for row in cursor.fetchall())
+            else:
+                for recipe_id in recipe_ids:
+                    cursor.execute(
+                        f'INSERT INTO {table} (user_id, recipe_id)'
+                        f' SELECT %s, id FROM {recipes} WHERE id = %s'
+                        ' ON CONFLICT (user_id, recipe_id) DO NOTHING',
+                        [user.id, recipe_id],
+                    )
+                    if cursor.rowcount == 1:
+                        inserted.add(recipe_id)
+        added = [
+            recipe_id for recipe_id in recipe_ids if recipe_id in inserted
+        ]
+        if added:
+            self.update_counters(added, 1)
+            self.bump_version()
+        return added
+
+    def add_one(self, user, recipe_id):
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        recipes = connection.ops.quote_name(Recipe._meta.db_table)
+        counter = connection.ops.quote_name(self.model.counter_field)
+        if connection.vendor != 'postgresql':
+            with transaction.atomic(using=self.db):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'INSERT INTO {table} (user_id, recipe_id)'
+                        f' SELECT %s, id FROM {recipes} WHERE id = %s'
+                        ' ON CONFLICT (user_id, recipe_id) DO NOTHING',
+                        [user.id, recipe_id],
+                    )
+                    added = cursor.rowcount == 1
+                if added:
+                    self.update_counters([recipe_id], 1)
+                    self.bump_version()
+            found = added or Recipe.objects.using(self.db).filter(
+                id=recipe_id
+            ).exists()
+            return found, added
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'WITH recipe AS (SELECT id FROM {recipes} WHERE id = %s),'
+                f' added AS (INSERT INTO {table} (user_id, recipe_id)'
+                ' SELECT %s, id FROM recipe'
+                ' ON CONFLICT (user_id, recipe_id) DO NOTHING'
+                ' RETURNING recipe_id),'
+                f' counted AS (UPDATE {recipes} SET {counter} = {counter} + 1'
+                ' WHERE id IN (SELECT recipe_id FROM added))'
+                ' SELECT EXISTS (SELECT 1 FROM recipe),'
+                ' EXISTS (SELECT 1 FROM added)',
+                [recipe_id, user.id],
+            )
+            found, added = cursor.fetchone()
+        if added:
+            self.bump_version()
+        return found, added
+
+    def remove_one(self, user, recipe_id):
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        recipes = connection.ops.quote_name(Recipe._meta.db_table)
+        counter = connection.ops.quote_name(self.model.counter_field)
+        if connection.vendor != 'postgresql':
+            with transaction.atomic(using=self.db):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'DELETE FROM {table}'
+                        ' WHERE user_id = %s AND recipe_id = %s'
+                        ' RETURNING recipe_id',
+                        [user.id, recipe_id],
+                    )
+                    removed = bool(cursor.fetchall())
+                if removed:
+                    self.update_counters([recipe_id], -1)
+                    self.bump_version()
+            return removed
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'WITH removed AS (DELETE FROM {table}'
+                ' WHERE user_id = %s AND recipe_id = %s RETURNING recipe_id)'
+                f' UPDATE {recipes} SET {counter} = {counter} - 1'
+                ' WHERE id IN (SELECT recipe_id FROM removed)',
+                [user.id, recipe_id],
+            )
+            removed = cursor.rowcount > 0
+        if removed:
+            self.bump_version()
+        return removed
+
+    @transaction.atomic
+    def remove_many(self, user, recipe_ids):
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        if not recipe_ids:
+            return []
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f'DELETE FROM {table}'
+                    ' WHERE user_id = %s AND recipe_id = ANY(%s)'
+                    ' RETURNING recipe_id',
+                    [user.id, recipe_ids],
+                )
+            else:
+                placeholders = ', '.join(['%s'] * len(recipe_ids))
+                cursor.execute(
+                    f'DELETE FROM {table}'
+                    f' WHERE user_id = %s AND recipe_id IN ({placeholders})'
+                    ' RETURNING recipe_id',
+                    [user.id, *recipe_ids],
+                )
+            deleted = {row[0] for row in cursor.fetchall()}
+        removed = [
+            recipe_id for recipe_id in recipe_ids if recipe_id in deleted
+        ]
+        if removed:
+            self.update_counters(removed, -1)
+            self.bump_version()
+        return removed
+
+
 class CartFavorites(models.Model):
     user = models.ForeignKey(
         User,
@@ -161,6 +516,8 @@ class CartFavorites(models.Model):
         on_delete=models.CASCADE,
     )
 
+    objects = CartFavoritesQuerySet.as_manager()
+
     class Meta:
         abstract = True
         default_related_name = '%(class)s'.lower()
@@ -176,6 +533,7 @@ class CartFavorites(models.Model):
 
 
 class Favorites(CartFavorites):
+    counter_field = 'favorites_count'
 
     class Meta(CartFavorites.Meta):
         verbose_name = 'Избранное'
@@ -183,7 +541,240 @@ class Favorites(CartFavorites):
 
 
 class ShoppingCart(CartFavorites):
+    counter_field = 'in_carts_count'
 
     class Meta(CartFavorites.Meta):
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзина'
+
+
+class ShoppingListQuerySet(models.QuerySet):
+
+    def apply_deltas(self, deltas):
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        with transaction.atomic(using=self.db):
+            self.increase(
+                {key: delta for key, delta in deltas.items() if delta > 0}
+            )
+            self.decrease(
+                {key: -delta for key, delta in deltas.items() if delta < 0}
+            )
+
+    def increase(self, deltas):
+        if not deltas:
+            return
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        rows = [(*key, delta) for key, delta in deltas.items()]
+        batch_size = connection.ops.bulk_batch_size(
+            ('user_id', 'ingredient_id', 'amount'), rows
+        )
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                values = ', '.join(['(%s, %s, %s)'] * len(batch))
+                cursor.execute(
+                    f'INSERT INTO {table} (user_id, ingredient_id, amount)'
+                    f' VALUES {values}'
+                    ' ON CONFLICT (user_id, ingredient_id) DO UPDATE'
+                    f' SET amount = {table}.amount + EXCLUDED.amount',
+                    [value for row in batch for value in row],
+                )
+
+    def decrease(self, deltas):
+        if not deltas:
+            return
+        updated, deleted = [], []
+        for item in self.select_for_update().filter(
+            user_id__in={user_id for user_id, _ in deltas},
+            ingredient_id__in={ingredient_id for _, ingredient_id in deltas},
+        ):
+            delta = deltas.get((item.user_id, item.ingredient_id))
+            if delta is None:
+                continue
+            if item.amount > delta:
+                item.amount -= delta
+                updated.append(item)
+            else:
+                deleted.append(item.pk)
+        self.bulk_update(updated, ('amount',))
+        self.filter(pk__in=deleted).delete()
+
+    def add_recipes(self, user_id, recipe_ids, sign=1):
+        deltas = defaultdict(int)
+        for ingredient_id, amount in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id', 'amount'):
+            deltas[(user_id, ingredient_id)] += sign * amount
+        self.apply_deltas(deltas)
+
+    def remove_recipes(self, user_id, recipe_ids):
+        self.add_recipes(user_id, recipe_ids, sign=-1)
+
+    def change_recipe(self, recipe_id, old_amounts, new_amounts):
+        changes = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        if not any(changes.values()):
+            return
+        self.apply_deltas({
+            (user_id, ingredient_id): delta
+            for user_id in ShoppingCart.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True)
+            for ingredient_id, delta in changes.items()
+        })
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+    )
+
+    objects = ShoppingListQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(fields=('user', 'ingredient'),
+                                    name='unique shopping list item')
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.amount}'
+
+
+def has_many_followers(author_id):
+    return Follow.objects.filter(author_id=author_id).order_by()[
+        settings.FEED_FANOUT_MAX_FOLLOWERS:
+    ].exists()
+
+
+class FeedEntryQuerySet(models.QuerySet):
+
+    def fan_out(self, recipes):
+        pulled = set(User.objects.filter(
+            id__in={recipe.author_id for recipe in recipes}, pull_feed=True
+        ).values_list('id', flat=True))
+        recipes = [
+            recipe for recipe in recipes if recipe.author_id not in pulled
+        ]
+        followers = defaultdict(list)
+        for author_id, user_id in Follow.objects.filter(
+            author_id__in={recipe.author_id for recipe in recipes}
+        ).values_list('author_id', 'user_id'):
+            followers[author_id].append(user_id)
+        self.bulk_create(
+            [
+                self.model(
+                    user_id=user_id,
+                    recipe_id=recipe.id,
+                    author_id=recipe.author_id,
+                )
+                for recipe in recipes
+                for user_id in followers[recipe.author_id]
+            ],
+            batch_size=settings.FEED_FANOUT_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def backfill(self, author_id, user_ids):
+        if User.objects.filter(pk=author_id, pull_feed=True).exists():
+            return
+        recipe_ids = Recipe.objects.filter(author_id=author_id).order_by(
+            '-id'
+        ).values_list('id', flat=True)[:settings.FEED_BACKFILL_SIZE]
+        self.bulk_create(
+            [
+                self.model(
+                    user_id=user_id, recipe_id=recipe_id, author_id=author_id
+                )
+                for user_id in user_ids
+                for recipe_id in recipe_ids
+            ],
+            batch_size=settings.FEED_FANOUT_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def trim(self, user_id, author_id):
+        self.filter(user_id=user_id, author_id=author_id).delete()
+
+    def update_mode(self, author_id):
+        pull_feed = has_many_followers(author_id)
+        if not User.objects.filter(
+            pk=author_id, pull_feed=not pull_feed
+        ).update(pull_feed=pull_feed):
+            return
+        if pull_feed:
+            self.filter(author_id=author_id).delete()
+        else:
+            self.backfill(author_id, Follow.objects.filter(
+                author_id=author_id
+            ).values_list('user_id', flat=True))
+
+    def recipe_ids(self, user, before=None, limit=10):
+        entries = self.filter(user=user)
+        pulled = Recipe.objects.filter(author_id__in=Follow.objects.filter(
+            user=user, author__pull_feed=True
+        ).values('author_id'))
+        if before is not None:
+            entries = entries.filter(recipe_id__lt=before)
+            pulled = pulled.filter(id__lt=before)
+        recipe_ids = set(entries.order_by('-recipe_id').values_list(
+            'recipe_id', flat=True
+        )[:limit]) | set(pulled.order_by('-id').values_list(
+            'id', flat=True
+        )[:limit])
+        return sorted(recipe_ids, reverse=True)[:limit]
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        verbose_name='Подписчик',
+        on_delete=models.CASCADE,
+        related_name='feed',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор',
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [
+            models.UniqueConstraint(fields=('user', 'recipe'),
+                                    name='unique feed entry')
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
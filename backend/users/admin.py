@@ -15,10 +15,11 @@ class UserAdmin(UserAdmin):
     )
     list_filter = (
         'is_active',
-        'email',
-        'first_name',
+        'is_staff',
     )
     search_fields = (
         'username',
         'email',
+        'first_name',
+        'last_name',
     )
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.3 on 2026-10-18 06:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pulled_authors(apps, schema_editor):
+    Follow = apps.get_model('users', 'Follow')
+    apps.get_model('users', 'User').objects.filter(
+        pk__in=Follow.objects.order_by().values('author').annotate(
+            followers=models.Count('pk')
+        ).filter(
+            followers__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+        ).values('author')
+    ).update(pull_feed=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20230711_1624'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='pull_feed',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Лента собирается при чтении'),
+        ),
+        migrations.RunPython(mark_pulled_authors, migrations.RunPython.noop),
+    ]
@@ -31,6 +31,11 @@ class User(AbstractUser):
         verbose_name='Пароль',
         max_length=settings.MAX_LEN_EMAIL_PWRD_FIELD,
     )
+    pull_feed = models.BooleanField(
+        verbose_name='Лента собирается при чтении',
+        default=False,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'